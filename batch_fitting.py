@@ -0,0 +1,268 @@
+import numpy as np
+
+'''
+Trust Region Reflective least squares for many small curve fits at once.
+It follows scipy.optimize.least_squares(method='trf'), which curve_fit uses with
+bounds, step by step, so the fits end in the same minima as with curve_fit.
+Datasets of different lengths are packed to zero padded arrays (fits × points)
+with a mask of valid points. Every fit has its own trust region and they are
+iterated together until each of them has converged or run out of evaluations.
+
+Status of each fit:
+ 1 = converged, 0 = maximum number of function evaluations reached, -1 = not fitted
+'''
+
+def pack(xs,ys):
+    '''Packs datasets of different lengths to padded arrays. Returns x, y and mask (fits × points).'''
+    lengths = np.array([len(y) for y in ys], dtype=int)
+    mask = np.arange(max(lengths.max(initial=0),1)) < lengths[:,None]
+    x = np.zeros(mask.shape)
+    y = np.zeros(mask.shape)
+    if len(lengths):
+        x[mask] = np.concatenate([np.asarray(data_x,dtype=float) for data_x in xs])
+        y[mask] = np.concatenate([np.asarray(data_y,dtype=float) for data_y in ys])
+    return x, y, mask
+def fit_batch(model,jacobian,x,y,mask,p0,lower,upper,max_nfev=None,ftol=1e-8,xtol=1e-8,gtol=1e-8):
+    '''
+    Fits model(x,*params) to every dataset in padded arrays x and y.
+
+    jacobian = function(x,params) that returns derivatives with shape (fits × points × params)
+    p0 = initial guesses (fits × params)
+    lower, upper = bounds of parameters (fits × params)
+    max_nfev = maximum number of function evaluations per fit, None = 100 × number of parameters
+    Returns fitted parameters (fits × params) and status of each fit.
+    '''
+    lower = np.broadcast_to(np.asarray(lower,dtype=float), np.shape(p0))
+    upper = np.broadcast_to(np.asarray(upper,dtype=float), np.shape(p0))
+    params = np.array(p0, dtype=float)
+    num_of_fits, num_of_params = params.shape
+    max_nfev = max_nfev or 100 * num_of_params
+    lengths = mask.sum(axis=1)
+    eps = np.finfo(float).eps
+
+    def residuals(p,i):
+        r = model(x[i], *(p.T[:,:,None])) - y[i]
+        return np.where(mask[i], r, 0.0)
+
+    def jac(p,i):
+        return np.where(mask[i][:,:,None], jacobian(x[i],p), 0.0)
+
+    def strictly_feasible(p,lo,up,rstep=0):
+        '''Moves parameters on (or within rstep of) a bound inside the bounds.'''
+        if rstep == 0:
+            at_lower, at_upper = p <= lo, p >= up
+            p = np.where(at_upper, np.nextafter(up,lo), np.where(at_lower, np.nextafter(lo,up), p))
+        else:
+            lower_dist, upper_dist = p - lo, up - p
+            lower_step, upper_step = rstep * np.maximum(1,np.abs(lo)), rstep * np.maximum(1,np.abs(up))
+            at_lower = np.isfinite(lo) & (lower_dist <= np.minimum(upper_dist, lower_step))
+            at_upper = np.isfinite(up) & (upper_dist <= np.minimum(lower_dist, upper_step))
+            p = np.where(at_upper, up - upper_step, np.where(at_lower, lo + lower_step, p))
+        return np.where((p < lo) | (p > up), 0.5 * (lo + up), p)
+
+    def scaling(p,g,i):
+        '''Coleman-Li scaling vector and its derivative.'''
+        to_upper = (g < 0) & np.isfinite(upper[i])
+        to_lower = (g > 0) & np.isfinite(lower[i])
+        v = np.where(to_lower, p - lower[i], np.where(to_upper, upper[i] - p, 1.0))
+        dv = np.where(to_lower, 1.0, np.where(to_upper, -1.0, 0.0))
+        return v, dv
+
+    def step_to_bound(p,s,lo,up):
+        '''Step size along s to the nearest bound and the parameters that hit it.'''
+        steps = np.where(s != 0, np.maximum((lo - p) / s, (up - p) / s), np.inf)
+        step = steps.min(axis=1)
+        return step, (steps == step[:,None]) & (s != 0)
+
+    def line_quadratic(J,g,s,diag,s0):
+        '''Coefficients a, b, c of the quadratic model along s0 + t*s.'''
+        v = np.einsum('fpi,fi->fp', J, s)
+        u = np.einsum('fpi,fi->fp', J, s0)
+        a = 0.5 * (np.sum(v*v, axis=1) + np.sum(s*diag*s, axis=1))
+        b = np.sum(g*s, axis=1) + np.sum(u*v, axis=1) + np.sum(s0*diag*s, axis=1)
+        c = 0.5 * np.sum(u*u, axis=1) + np.sum(g*s0, axis=1) + 0.5 * np.sum(s0*diag*s0, axis=1)
+        return a, b, c
+
+    def minimize_1d(a,b,c,lo,up):
+        '''Minimum of a*t**2 + b*t + c with lo <= t <= up.'''
+        extremum = -0.5 * b / a
+        inside = (a != 0) & (lo < extremum) & (extremum < up)
+        t = np.stack([lo, up, np.where(inside, extremum, lo)], axis=1)
+        values = t * (a[:,None]*t + b[:,None]) + c[:,None]
+        best = np.argmin(values, axis=1)
+        rows = np.arange(len(t))
+        return t[rows,best], values[rows,best]
+
+    def trust_region_step(uf,s,V,Delta,alpha,m):
+        '''Solves the trust region problem from the SVD of the scaled jacobian (More's method).'''
+        suf = s * uf
+        full_rank = (m >= num_of_params) & (s[:,-1] > eps * m * s[:,0])
+        p_gauss_newton = -np.einsum('fij,fj->fi', V, uf / s)
+        gauss_newton = full_rank & (np.linalg.norm(p_gauss_newton, axis=1) <= Delta)
+
+        def phi_and_derivative(alpha):
+            denom = s**2 + alpha[:,None]
+            p_norm = np.linalg.norm(suf / denom, axis=1)
+            return p_norm - Delta, -np.sum(suf**2 / denom**3, axis=1) / p_norm
+
+        alpha_upper = np.linalg.norm(suf, axis=1) / Delta
+        phi, phi_prime = phi_and_derivative(np.zeros(len(s)))
+        alpha_lower = np.where(full_rank, -phi / phi_prime, 0.0)
+        alpha = np.where(~full_rank & (alpha == 0), np.maximum(0.001 * alpha_upper, (alpha_lower * alpha_upper)**0.5), alpha)
+        done = gauss_newton.copy()
+        for iteration in range(10):
+            if done.all():
+                break
+            reset = ~done & ((alpha < alpha_lower) | (alpha > alpha_upper))
+            alpha = np.where(reset, np.maximum(0.001 * alpha_upper, (alpha_lower * alpha_upper)**0.5), alpha)
+            phi, phi_prime = phi_and_derivative(alpha)
+            alpha_upper = np.where(~done & (phi < 0), alpha, alpha_upper)
+            ratio = phi / phi_prime
+            alpha_lower = np.where(done, alpha_lower, np.maximum(alpha_lower, alpha - ratio))
+            alpha = np.where(done, alpha, alpha - (phi + Delta) * ratio / Delta)
+            done |= np.abs(phi) < 0.01 * Delta
+
+        p = -np.einsum('fij,fj->fi', V, suf / (s**2 + alpha[:,None]))
+        p *= (Delta / np.linalg.norm(p, axis=1))[:,None]
+        return np.where(gauss_newton[:,None], p_gauss_newton, p), np.where(gauss_newton, 0.0, alpha)
+
+    def select_step(i,p_h):
+        '''Chooses the trust region step, its reflection from a bound or the scaled gradient step.'''
+        p0, lo, up, d_i, Delta_i, theta_i = params[i], lower[i], upper[i], d[i], Delta[i], theta[i]
+        J_h, diag_i, g_h = J[i] * d_i[:,None,:], diag_h[i], d_i * g[i]
+        zeros = np.zeros(p_h.shape)
+        p = d_i * p_h
+        full_step = np.all((p0 + p >= lo) & (p0 + p <= up), axis=1)
+        full_value = line_quadratic(J_h, g_h, zeros, diag_i, p_h)[2]
+        full_p, full_p_h = p, p_h
+
+        #restrict the step to the bound and reflect it from there
+        p_stride, hits = step_to_bound(p0, p, lo, up)
+        r_h = np.where(hits, -p_h, p_h)
+        r = d_i * r_h
+        p, p_h = p * p_stride[:,None], p_h * p_stride[:,None]
+        a = np.sum(r_h*r_h, axis=1)
+        b = np.sum(p_h*r_h, axis=1)
+        c = np.sum(p_h*p_h, axis=1) - Delta_i**2
+        q = -(b + np.copysign(np.sqrt(b*b - a*c), b))
+        to_tr = np.maximum(q / a, c / q)
+        to_bound = step_to_bound(p0 + p, r, lo, up)[0]
+        r_stride = np.minimum(to_bound, to_tr)
+        r_stride_l = np.where(r_stride > 0, (1 - theta_i) * p_stride / r_stride, 0.0)
+        r_stride_u = np.where(r_stride > 0, np.where(r_stride == to_bound, theta_i * to_bound, to_tr), -1.0)
+        r_stride, r_value = minimize_1d(*line_quadratic(J_h, g_h, r_h, diag_i, p_h), r_stride_l, r_stride_u)
+        r_value = np.where(r_stride_l <= r_stride_u, r_value, np.inf)
+        r_h = r_h * r_stride[:,None] + p_h
+        r = r_h * d_i
+
+        #step back from the bound
+        p, p_h = p * theta_i[:,None], p_h * theta_i[:,None]
+        p_value = line_quadratic(J_h, g_h, zeros, diag_i, p_h)[2]
+
+        #step along the scaled gradient
+        ag_h = -g_h
+        ag = d_i * ag_h
+        to_tr = Delta_i / np.linalg.norm(ag_h, axis=1)
+        to_bound = step_to_bound(p0, ag, lo, up)[0]
+        ag_stride = np.where(to_bound < to_tr, theta_i * to_bound, to_tr)
+        ag_stride, ag_value = minimize_1d(*line_quadratic(J_h, g_h, ag_h, diag_i, zeros), zeros[:,0], ag_stride)
+        ag_h, ag = ag_h * ag_stride[:,None], ag * ag_stride[:,None]
+
+        use_p = (p_value < r_value) & (p_value < ag_value)
+        use_r = ~use_p & (r_value < p_value) & (r_value < ag_value)
+        step = np.where(use_p[:,None], p, np.where(use_r[:,None], r, ag))
+        step_h = np.where(use_p[:,None], p_h, np.where(use_r[:,None], r_h, ag_h))
+        value = np.where(use_p, p_value, np.where(use_r, r_value, ag_value))
+        full_step = full_step[:,None]
+        return np.where(full_step, full_p, step), np.where(full_step, full_p_h, step_h), -np.where(full_step[:,0], full_value, value)
+
+    #fits that can't be done at all (curve_fit would raise an error)
+    status = np.full(num_of_fits, -1)
+    f = np.zeros(y.shape)
+    J = np.zeros(y.shape + (num_of_params,))
+    g = np.zeros(params.shape)
+    with np.errstate(all='ignore'):
+        active = (np.all(lower < upper, axis=1) & np.all((params >= lower) & (params <= upper), axis=1)
+                  & np.all(np.isfinite(np.where(mask, x, 0.0)) & np.isfinite(np.where(mask, y, 0.0)), axis=1))
+        i = np.flatnonzero(active)
+        params[i] = strictly_feasible(params[i], lower[i], upper[i], rstep=1e-10)
+        f[i] = residuals(params[i], i)
+        active &= np.all(np.isfinite(f), axis=1)
+        i = np.flatnonzero(active)
+        J[i] = jac(params[i], i)
+        g[i] = np.einsum('fpi,fp->fi', J[i], f[i])
+    status[active] = 0
+    cost = 0.5 * np.sum(f**2, axis=1)
+    nfev = np.ones(num_of_fits, dtype=int)
+
+    #initial trust regions
+    v = scaling(params, g, np.arange(num_of_fits))[0]
+    with np.errstate(all='ignore'):
+        Delta = np.linalg.norm(params / v**0.5, axis=1)
+    Delta[Delta == 0] = 1.0
+    alpha = np.zeros(num_of_fits)
+    d = np.ones(params.shape)
+    diag_h = np.zeros(params.shape)
+    theta = np.zeros(num_of_fits)
+    s = np.ones(params.shape)
+    V = np.zeros(params.shape + (num_of_params,))
+    uf = np.zeros(params.shape)
+    new_iteration = active.copy()
+
+    with np.errstate(all='ignore'):
+        while active.any():
+            #start a new iteration in fits that moved (or ran out of evaluations)
+            i = np.flatnonzero(active & new_iteration)
+            if len(i):
+                v, dv = scaling(params[i], g[i], i)
+                g_norm = np.max(np.abs(g[i] * v), axis=1)
+                status[i[g_norm < gtol]] = 1
+                stop = (g_norm < gtol) | (nfev[i] >= max_nfev)
+                active[i[stop]] = False
+                i, v, dv, g_norm = i[~stop], v[~stop], dv[~stop], g_norm[~stop]
+                d[i] = v**0.5
+                diag_h[i] = g[i] * dv
+                J_augmented = np.concatenate([J[i] * d[i][:,None,:], diag_h[i][:,:,None]**0.5 * np.eye(num_of_params)], axis=1)
+                U, s[i], VT = np.linalg.svd(J_augmented, full_matrices=False)
+                V[i] = np.swapaxes(VT, 1, 2)
+                uf[i] = np.einsum('fpi,fp->fi', U[:,:f.shape[1]], f[i])
+                theta[i] = np.maximum(0.995, 1 - g_norm)
+                new_iteration[i] = False
+
+            #try a step in every fit
+            i = np.flatnonzero(active)
+            if not len(i):
+                break
+            p_h, alpha[i] = trust_region_step(uf[i], s[i], V[i], Delta[i], alpha[i], lengths[i])
+            step, step_h, predicted = select_step(i, p_h)
+            params_new = strictly_feasible(params[i] + step, lower[i], upper[i])
+            f_new = residuals(params_new, i)
+            nfev[i] += 1
+            step_h_norm = np.linalg.norm(step_h, axis=1)
+            finite = np.all(np.isfinite(f_new), axis=1)
+            cost_new = 0.5 * np.sum(f_new**2, axis=1)
+            reduction = cost[i] - cost_new
+
+            #update trust region radius
+            ratio = np.where(predicted > 0, reduction / predicted, np.where((predicted == 0) & (reduction == 0), 1.0, 0.0))
+            Delta_new = np.where(ratio < 0.25, 0.25 * step_h_norm,
+                                 np.where((ratio > 0.75) & (step_h_norm > 0.95 * Delta[i]), 2.0 * Delta[i], Delta[i]))
+            converged = finite & (((reduction < ftol * cost[i]) & (ratio > 0.25))
+                                  | (np.linalg.norm(step, axis=1) < xtol * (xtol + np.linalg.norm(params[i], axis=1))))
+            resized = finite & ~converged
+            alpha[i] = np.where(resized, alpha[i] * Delta[i] / Delta_new, alpha[i])
+            Delta[i] = np.where(resized, Delta_new, np.where(finite, Delta[i], 0.25 * step_h_norm))
+
+            #accept steps that decrease the cost
+            better = finite & (reduction > 0)
+            j = i[better]
+            params[j], f[j], cost[j] = params_new[better], f_new[better], cost_new[better]
+            status[i[converged]] = 1
+            active[i[converged]] = False
+            j = i[better & ~converged]
+            J[j] = jac(params[j], j)
+            g[j] = np.einsum('fpi,fp->fi', J[j], f[j])
+            new_iteration[j] = True
+            new_iteration[i[~better & (nfev[i] >= max_nfev)]] = True
+
+    return params, status
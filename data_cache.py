@@ -0,0 +1,97 @@
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from hashlib import sha1
+
+'''
+Cache of loaded PNSD data (time × diameter). The cleaned matrix of the padded
+time period (df) is saved as .npy files with the rows and columns of the
+plotting period (df_plot), and reruns with the same file and time period
+read them memory mapped instead of parsing the data file again.
+Cache folders are keyed by a hash of the data file, the loader and the time period.
+
+Format of cache folder:
+values = concentrations (time × diameter), times, diams, index_name = index and columns of df
+plot_rows = first and last+1 row of df_plot, plot_columns = columns of df in df_plot (boolean)
+'''
+
+def file_hash(file,cache_dir='loader_cache'):
+    '''
+    Hash of the file contents. Hashes are saved with the size and modification
+    time of the file, so large files are only read again after they change.
+    '''
+    stat = os.stat(file)
+    file_id = f'{os.path.abspath(file)}|{stat.st_size}|{stat.st_mtime_ns}'
+    index_file = os.path.join(cache_dir,'hashes.json')
+    try:
+        with open(index_file) as input_file:
+            hashes = json.load(input_file)
+    except (FileNotFoundError, ValueError):
+        hashes = {}
+    if file_id in hashes:
+        return hashes[file_id]
+
+    digest = sha1()
+    with open(file,'rb') as data_file:
+        for chunk in iter(lambda: data_file.read(1 << 20), b''):
+            digest.update(chunk)
+    hashes[file_id] = digest.hexdigest()
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(index_file + '.tmp','w') as output_file:
+        json.dump(hashes, output_file)
+    os.replace(index_file + '.tmp', index_file)
+    return hashes[file_id]
+def save_frames(data_dir,df,df_plot):
+    '''Saves df and rows and columns of df_plot in it (written to a temporary folder first).'''
+    plot_start = df.index.searchsorted(df_plot.index[0]) if len(df_plot) else 0
+    columns = {'values': df.to_numpy(),
+               'times': df.index.to_numpy(),
+               'diams': np.asarray(df.columns, dtype=float),
+               'index_name': np.array([df.index.name or '']),
+               'plot_rows': np.array([plot_start, plot_start + len(df_plot)]),
+               'plot_columns': df.columns.isin(df_plot.columns)}
+
+    temporary_dir = data_dir + '.tmp'
+    shutil.rmtree(temporary_dir, ignore_errors=True)
+    os.makedirs(temporary_dir)
+    for name, column in columns.items():
+        np.save(os.path.join(temporary_dir,f'{name}.npy'), column)
+    shutil.rmtree(data_dir, ignore_errors=True)
+    os.replace(temporary_dir, data_dir)
+def load_frames(data_dir):
+    '''
+    Loads df and df_plot from cache folder. Values are memory mapped
+    copy-on-write, so changes to the dataframes never reach the file.
+    '''
+    def load(name,mode=None):
+        return np.load(os.path.join(data_dir,f'{name}.npy'), mmap_mode=mode)
+    
+    values = load('values','c')
+    times = pd.DatetimeIndex(load('times'), name=str(load('index_name')[0]) or None)
+    diams = pd.Index(load('diams'))
+    plot_start, plot_end = load('plot_rows')
+    plot_columns = load('plot_columns')
+
+    df = pd.DataFrame(values, index=times, columns=diams, copy=False)
+    df_plot = df.iloc[plot_start:plot_end] #view of df
+    if not plot_columns.all():
+        df_plot = df_plot.iloc[:, np.flatnonzero(plot_columns)]
+    return df, df_plot
+def load_cached(loader,file_name,start_date,end_date,cache_dir='loader_cache'):
+    '''
+    Loads data with loader (load_NC_data or load_AVAA_data) or from the cache
+    if the same file and time period has been loaded before.
+    Returns df and df_plot like the loaders.
+    '''
+    key = sha1(f'{file_hash(file_name,cache_dir)}|{loader.__name__}|{start_date}|{end_date}'.encode()).hexdigest()[:16]
+    data_dir = os.path.join(cache_dir,key)
+    if os.path.isdir(data_dir):
+        print(f"Data loaded from cache ({data_dir})")
+        return load_frames(data_dir)
+
+    df, df_plot = loader(file_name,start_date,end_date)
+    save_frames(data_dir,df,df_plot)
+    return df, df_plot
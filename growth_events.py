@@ -1,5 +1,5 @@
 import numpy as np
-from copy import deepcopy
+import pandas as pd
 from collections import defaultdict
 from matplotlib.dates import num2date, date2num
 from datetime import timedelta
@@ -42,72 +42,119 @@ def round_down_to_quarter(dt):
     return dt.replace(hour=hour, minute=new_minute, second=0, microsecond=0)
 
 ################## FORMING EVENTS ###################
-def detect_events(df_data,MF_gr_points,MC_gr_points,AT_gr_points,mc_area_edges,mgsc):
-    '''Groups lines to the same growth event with multiple conditions.'''
-
-    def group_lines(data):
-        '''From AI'''
-        # Step 1: Build the graph (connections between line IDs)
-        graph = defaultdict(set)
-        line_to_id = {}  # Map each unique line to a unique ID
-        id_counter = 0
-
-        for lines in data:
-            pair_ids = []
-            for line in lines:
-                # Convert line to a tuple representation for uniqueness
-                line_tuple = tuple((k, tuple(v)) if isinstance(v, list) else (k, v) for k, v in line.items())
-                if line_tuple not in line_to_id:
-                    line_to_id[line_tuple] = id_counter
-                    id_counter += 1
-                pair_ids.append(line_to_id[line_tuple])
-
-            # Connect all lines in the same pair
-            for i in pair_ids:
-                for j in pair_ids:
-                    if i != j:
-                        graph[i].add(j)
-        
-        # Ensure all single elements are in the graph, even if unconnected
-        for line_id in line_to_id.values():
-            if line_id not in graph:
-                graph[line_id] = set()
+def line_boxes(lines):
+    '''
+    Bounding boxes (time and diameter) of fitted points of lines, sorted by start time.
+    Format: {'order': indices of lines, 't_min': ..., 't_max': ..., 'd_min': ..., 'd_max': ...}
+    '''
+    boxes = np.array([(min(t), max(t), min(d), max(d)) for t, d in (zip(*line['fitted points']) for line in lines)]).reshape(-1,4)
+    order = np.argsort(boxes[:,0], kind='stable')
+    return {'order': order, 't_min': boxes[order,0], 't_max': boxes[order,1], 'd_min': boxes[order,2], 'd_max': boxes[order,3]}
+def overlapping_boxes(boxes,t_min,t_max,d_min=-np.inf,d_max=np.inf):
+    '''Indices of lines (in original order) with bounding boxes that intersect the given box.'''
+    end = np.searchsorted(boxes['t_min'], t_max, side='right') #boxes that start before the given box ends
+    hits = (boxes['t_max'][:end] >= t_min) & (boxes['d_min'][:end] <= d_max) & (boxes['d_max'][:end] >= d_min)
+    return np.sort(boxes['order'][:end][hits])
+def area_table(mc_area_edges):
+    '''
+    Peak areas (diameter, start, end) as numeric arrays by diameter channel, sorted by start time.
+    Format: {diameter: {'index': area indices, 'start': ..., 'end': ..., 'max_end': running maximum of end times}}, times in days
+    '''
+    diams = np.array([area[0] for area in mc_area_edges], dtype=float)
+    starts = date2num(pd.DatetimeIndex([area[1] for area in mc_area_edges]).to_numpy())
+    ends = date2num(pd.DatetimeIndex([area[2] for area in mc_area_edges]).to_numpy())
+    
+    table = {}
+    for diam in np.unique(diams):
+        index = np.flatnonzero(diams == diam)
+        index = index[np.argsort(starts[index], kind='stable')]
+        table[diam] = {'index': index, 'start': starts[index], 'end': ends[index], 'max_end': np.maximum.accumulate(ends[index])}
+    return table
+def areas_of_points(times,diams,table):
+    '''
+    Finds peak areas that contain points (start <= time <= end in the same diameter channel).
+    Returns indices of points and areas (one pair per match).
+    '''
+    point_ids, area_ids = [], []
+    for diam, channel in table.items():
+        points = np.flatnonzero(diams == diam)
+        t = times[points]
         
-        # Reverse map IDs back to original lines
-        id_to_line = {v: {k: (list(val) if isinstance(val, tuple) else val) for k, val in dict(line).items()} for line, v in line_to_id.items()}
-
-        # Step 2: Find connected components
-        visited = set()
-        groups = []
-
-        def dfs(node, group):
-            visited.add(node)
-            group.append(id_to_line[node])
-            for neighbor in graph[node]:
-                if neighbor not in visited:
-                    dfs(neighbor, group)
-
-        for node in graph:
-            if node not in visited:
-                group = []
-                dfs(node, group)
-                groups.append(group)
-
-        # Step 3: Organize into dictionary
-        grouped_dict = {f"event{i+1}": group for i, group in enumerate(groups)}
-        return grouped_dict
+        #areas starting before each point, later areas are checked first and earlier
+        #ones only as long as their end times (running maximum) can reach the point
+        j = np.searchsorted(channel['start'], t, side='right') - 1
+        while points.size:
+            reachable = (j >= 0) & (channel['max_end'][np.maximum(j,0)] >= t)
+            points, t, j = points[reachable], t[reachable], j[reachable]
+            hit = channel['end'][j] >= t
+            point_ids.append(points[hit])
+            area_ids.append(channel['index'][j[hit]])
+            j = j - 1
+    return np.concatenate(point_ids or [np.array([],dtype=int)]), np.concatenate(area_ids or [np.array([],dtype=int)])
+def line_area_counts(lines,table):
+    '''Number of points of each line in each peak area: [{area index: count}, ...].'''
+    line_ids = np.repeat(np.arange(len(lines)), [len(line['points']) for line in lines])
+    times, diams = np.array([point for line in lines for point in line['points']], dtype=float).reshape(-1,2).T
+    point_ids, area_ids = areas_of_points(times,diams,table)
+    
+    counts = [defaultdict(int) for line in lines]
+    for line_id, area_id in zip(line_ids[point_ids], area_ids):
+        counts[line_id][area_id] += 1
+    return counts
+def group_lines(pairs,num_of_lines):
+    '''
+    Groups lines that are connected by pairs (union-find on line IDs).
+    Lines of a group are in order of first appearance in pairs,
+    groups are in order of their first line.
+    Returns list of groups (lists of line IDs).
+    '''
+    parent = list(range(num_of_lines))
+    size = [1] * num_of_lines
     
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]] #path halving
+            i = parent[i]
+        return i
     
+    for pair in pairs:
+        root = find(pair[0])
+        for line_id in pair[1:]:
+            other = find(line_id)
+            if other != root:
+                if size[other] > size[root]:
+                    root, other = other, root
+                parent[other] = root
+                size[root] += size[other]
+
+    groups = {}
+    for line_id in dict.fromkeys(line_id for pair in pairs for line_id in pair):
+        groups.setdefault(find(line_id), []).append(line_id)
+    return list(groups.values())
+def detect_events(df_data,MF_gr_points,MC_gr_points,AT_gr_points,mc_area_edges,mgsc):
+    '''
+    Groups lines to the same growth event with multiple conditions.
+    Returns copies of all lines and events (lists of line IDs = indices in lines).
+    '''
+
+    #lines are referred to with IDs (index in lines)
+    MF_lines, MC_lines, AT_lines = list(MF_gr_points.values()), list(MC_gr_points.values()), list(AT_gr_points.values())
+    lines = MF_lines + MC_lines + AT_lines
+    MC_ids = range(len(MF_lines), len(MF_lines) + len(MC_lines))
+    AT_ids = range(len(MF_lines) + len(MC_lines), len(lines))
     pairs = []
-    #1 mode fitting overlaps
-    for MF_line in MF_gr_points.values():
+    MC_boxes, AT_boxes = line_boxes(MC_lines), line_boxes(AT_lines)
+    
+    #1 mode fitting overlaps (points are checked only for lines with overlapping bounding boxes)
+    for MF_id, MF_line in enumerate(MF_lines):
         MF_t_fit, MF_d_fit = zip(*MF_line['fitted points'])
         MF_gr = MF_line['growth rate']
         MF_min_t, MF_max_t = min(MF_t_fit), max(MF_t_fit)
         MF_min_d, MF_max_d = min(MF_d_fit), max(MF_d_fit)
         
         #modefitting and maximum concentration
-        for MC_line in MC_gr_points.values():
+        for i in overlapping_boxes(MC_boxes,MF_min_t,MF_max_t,MF_min_d,MF_max_d):
+            MC_line = MC_lines[i]
             MC_t_fit, MC_d_fit = zip(*MC_line['fitted points'])
             
             valid_points = [
@@ -120,10 +167,15 @@ def detect_events(df_data,MF_gr_points,MC_gr_points,AT_gr_points,mc_area_edges,m
             if valid_points:
                 MF_line['method'] = 'MF'
                 MC_line['method'] = 'MC'
-                pairs.append([MF_line, MC_line])
+                pairs.append([MF_id, MC_ids[i]])
             
         #mode fitting and appearance time
-        for AT_line in AT_gr_points.values():
+        if MF_gr >= 0:
+            AT_candidates = overlapping_boxes(AT_boxes,MF_min_t,MF_max_t,d_max=MF_max_d+MF_max_d*0.5)
+        else:
+            AT_candidates = overlapping_boxes(AT_boxes,MF_min_t,MF_max_t,d_min=MF_min_d-MF_min_d*0.2)
+        for i in AT_candidates:
+            AT_line = AT_lines[i]
             AT_t_fit, AT_d_fit = zip(*AT_line['fitted points'])
             AT_gr = AT_line['growth rate']
             
@@ -155,47 +207,50 @@ def detect_events(df_data,MF_gr_points,MC_gr_points,AT_gr_points,mc_area_edges,m
             if valid_points:
                 AT_line['method'] = 'AT'
                 MF_line['method'] = 'MF'
-                pairs.append([MF_line, AT_line])
+                pairs.append([MF_id, AT_ids[i]])
 
     #black lines with time length of more than 4h and in higher diameter channels
-    for MF_line in MF_gr_points.values():
+    for MF_id, MF_line in enumerate(MF_lines):
         MF_t, MF_d = zip(*MF_line['points'])
         time_len = max(MF_t)-min(MF_t)
         t_diff_threshold = 4 #hours
         
         if time_len >= t_diff_threshold/24 and any(d >= mgsc for d in MF_d):
             MF_line['method'] = 'MF'
-            pairs.append([MF_line])
+            pairs.append([MF_id])
     
     #maximum concentration and appearance time
-    for MC_line in MC_gr_points.values(): 
-        for AT_line in AT_gr_points.values():
-            MC_t, MC_d = zip(*MC_line['points'])
-            AT_t, AT_d = zip(*AT_line['points'])
-
-            mc_areas_with_at_point = [area for area in mc_area_edges for t,d in zip(AT_t,AT_d)
-                                      if d == area[0] and t >= date2num(area[1]) and t <= date2num(area[2])]
-            
-            #find matching areas
-            matching_areas = [area for area in mc_areas_with_at_point for t,d in zip(MC_t,MC_d)
-                              if d == area[0] and t >= date2num(area[1]) and t <= date2num(area[2])]
-            
-            #at least 2 points have to match
-            if len(matching_areas) >= 2:
-                MC_line['method'] = 'MC'
-                AT_line['method'] = 'AT'
+    #points of each line in peak areas, only lines with points in the same areas are compared
+    table = area_table(mc_area_edges)
+    MC_counts, AT_counts = line_area_counts(MC_lines,table), line_area_counts(AT_lines,table)
+    MC_lines_in_area = defaultdict(list)
+    for i, counts in enumerate(MC_counts):
+        for area in counts:
+            MC_lines_in_area[area].append(i)
+    candidates = sorted({(i, j) for j, counts in enumerate(AT_counts) for area in counts for i in MC_lines_in_area[area]})
+    
+    for i, j in candidates:
+        #matching areas = pairs of MC and AT points in the same area
+        matching_areas = sum(count * MC_counts[i].get(area,0) for area, count in AT_counts[j].items())
+        
+        #at least 2 points have to match
+        if matching_areas >= 2:
+            MC_lines[i]['method'] = 'MC'
+            AT_lines[j]['method'] = 'AT'
 
-                pairs.append([MC_line, AT_line])
+            pairs.append([MC_ids[i], AT_ids[j]])
     
-    #group lines to events
-    events = group_lines(pairs)
+    #group lines to events (lists of line IDs), events refer to copies of lines
+    events = group_lines(pairs,len(lines))
+    lines = [{key: list(value) if isinstance(value,(list,tuple)) else value for key, value in line.items()} for line in lines]
     
 
     ######################################
     #2 mean absolute fractional error (MAFE) of white and black lines
-    filtered_events = {}
+    filtered_events = []
 
-    for event_label, event in events.items():
+    for event_ids in events:
+        event = [lines[line_id] for line_id in event_ids]
         growth_rates = np.array([line['growth rate'] for line in event])
         grs_copy = growth_rates.copy()
         remaining_lines_i = list(range(len(growth_rates)))  #track indices of remaining lines
@@ -292,12 +347,13 @@ def detect_events(df_data,MF_gr_points,MC_gr_points,AT_gr_points,mc_area_edges,m
                     break
         
         if remaining_lines_i:
-            #add to dictionary
-            filtered_events[event_label] = [event[i] for i in remaining_lines_i]
+            #add to events
+            filtered_events.append([event_ids[i] for i in remaining_lines_i])
     
     #2.5
     #if a black and white line remain, check that their areas overlap
-    for event_label, event in filtered_events.items():
+    for event_num, event_ids in enumerate(filtered_events):
+        event = [lines[line_id] for line_id in event_ids]
         unique_methods = set([line['method'] for line in event])
         
         valid_lines_i = []
@@ -326,109 +382,107 @@ def detect_events(df_data,MF_gr_points,MC_gr_points,AT_gr_points,mc_area_edges,m
                         valid_lines_i.extend(new_lines)
 
             #remove lines that don't overlap
-            filtered_events[event_label] = [event[i] for i in valid_lines_i]
-
-    return filtered_events
-def split_events(filtered_events):
-    '''Determine final events.'''
+            filtered_events[event_num] = [event_ids[i] for i in valid_lines_i]
+
+    return lines, filtered_events
+def line_arrays(lines):
+    '''Fitted and original points of lines as arrays: [{'t_fit': ..., 'd_fit': ..., 't': ..., 'd': ...}, ...].'''
+    arrays = []
+    for line in lines:
+        t_fit, d_fit = np.array(line['fitted points'], dtype=float).reshape(-1,2).T
+        t, d = np.array(line['points'], dtype=float).reshape(-1,2).T
+        arrays.append({'t_fit': t_fit, 'd_fit': d_fit, 't': t, 'd': d})
+    return arrays
+def split_events(lines,filtered_events,arrays):
+    '''
+    Determine final events.
+    arrays = points of lines as arrays (see line_arrays)
+    '''
     
+    def most_overlapping(line_ids,overlapping_points):
+        '''Line with most overlapping points, the lowest line ID on ties (None if no overlap).'''
+        most = max(overlapping_points, default=0)
+        return min(line_id for line_id, count in zip(line_ids,overlapping_points) if count == most) if most > 0 else None
+
     #split events to smaller bits
-    divided_events = {}
-    new_events = {}
+    divided_events = []
+    new_events = []
     
-    count = 1
-    for event_label, event in filtered_events.items():
-        remaining_lines_i = list(range(len(event)))  #track indices of remaining lines
-        MF_lines = [(i,line) for i,line in enumerate(event) if line['method'] == 'MF']
-        MC_lines = [(i,line) for i,line in enumerate(event) if line['method'] == 'MC']
-        AT_lines = [(i,line) for i,line in enumerate(event) if line['method'] == 'AT']
+    for event in filtered_events:
+        remaining_lines = event
+        MF_ids = [line_id for line_id in event if lines[line_id]['method'] == 'MF']
+        MC_ids = [line_id for line_id in event if lines[line_id]['method'] == 'MC']
+        AT_ids = [line_id for line_id in event if lines[line_id]['method'] == 'AT']
         
-        for i,MC_line in MC_lines:
-            new_event = [MC_line]
-            new_event_i = [i]
-            MC_t, MC_d = zip(*MC_line['points'])
+        for MC_id in MC_ids:
+            new_event = [MC_id]
+            MC_t, MC_d = arrays[MC_id]['t'], arrays[MC_id]['d']
+            MC_len = len(arrays[MC_id]['t_fit'])
             
             #mf line with most time and diameter overlap
             overlapping_points = []
-            for ii,MF_line in MF_lines:
-                MF_points_overlap = [i for i,MF_point in enumerate(MF_line['fitted points']) if min(MC_t) <= MF_point[0] <= max(MC_t) and min(MC_d) <= MF_point[1] <= max(MC_d)]
-                overlap_count = len(MF_points_overlap)
+            for MF_id in MF_ids:
+                MF_t_fit, MF_d_fit = arrays[MF_id]['t_fit'], arrays[MF_id]['d_fit']
+                overlap_count = np.count_nonzero((MC_t.min() <= MF_t_fit) & (MF_t_fit <= MC_t.max()) & (MC_d.min() <= MF_d_fit) & (MF_d_fit <= MC_d.max()))
                 
                 #and at least 30% (rounded up) of points in either line overlap
-                if overlap_count >= round_half_up(len(MC_line['fitted points'])*0.3) or overlap_count >= round_half_up(len(MF_line['fitted points'])*0.3):
-                    overlapping_points.append(len(MF_points_overlap))
+                if overlap_count >= round_half_up(MC_len*0.3) or overlap_count >= round_half_up(len(MF_t_fit)*0.3):
+                    overlapping_points.append(overlap_count)
                 else:
                     overlapping_points.append(0)
             
-            if overlapping_points and not all(num == 0 for num in overlapping_points):
-                lines = [line for i,line in MF_lines]
-                best_MF_line = lines[np.argmax(overlapping_points)]
-                new_event.append(best_MF_line)
-                
-                idx = [i for i, line in enumerate(event) if line == best_MF_line][0]
-                new_event_i.append(idx)
+            MF_id = most_overlapping(MF_ids,overlapping_points)
+            if MF_id is not None:
+                new_event.append(MF_id)
             #WHAT ABOUT WHEN ONLY GREEN AND BLACK???
             
             #at line with most diameter overlap
             overlapping_points = []
-            for ii,AT_line in AT_lines:
-                AT_points_overlap = [i for i,AT_point in enumerate(AT_line['fitted points']) if min(MC_d) <= AT_point[1] <= max(MC_d)]
-                overlap_count = len(AT_points_overlap)
+            for AT_id in AT_ids:
+                AT_d_fit = arrays[AT_id]['d_fit']
+                overlap_count = np.count_nonzero((MC_d.min() <= AT_d_fit) & (AT_d_fit <= MC_d.max()))
                 
                 #and at least 50% (rounded up) of points in either line overlap
-                if overlap_count >= round_half_up(len(MC_line['fitted points'])/2) or overlap_count >= round_half_up(len(AT_line['fitted points'])/2):
-                    overlapping_points.append(len(AT_points_overlap))
+                if overlap_count >= round_half_up(MC_len/2) or overlap_count >= round_half_up(len(AT_d_fit)/2):
+                    overlapping_points.append(overlap_count)
                 else:
                     overlapping_points.append(0)
             
-            if overlapping_points and not all(num == 0 for num in overlapping_points):
-                lines = [line for i,line in AT_lines]
-                best_AT_line = lines[np.argmax(overlapping_points)]
-                new_event.append(best_AT_line)
-                
-                idx = [i for i, line in enumerate(event) if line == best_AT_line][0]
-                new_event_i.append(idx)
-                
+            AT_id = most_overlapping(AT_ids,overlapping_points)
+            if AT_id is not None:
+                new_event.append(AT_id)
             
             if len(new_event) > 1:
-                new_events[f'event{len(filtered_events.values())+count}'] = new_event #add new event
-                remaining_lines_i = [] #remove all remaining lines
-                count += 1 #keeps track of event number
+                new_events.append(new_event) #add new event
+                remaining_lines = [] #remove all remaining lines
 
-        divided_events[event_label] = [event[i] for i in remaining_lines_i]  
+        divided_events.append(remaining_lines)
 
-    divided_events = divided_events | new_events
+    return divided_events + new_events
+def filter_events(lines,events,arrays,df_plot,mgsc):
+    '''
+    Filter faulty events.
+    arrays = points of lines as arrays (see line_arrays)
+    '''
+    plot_start, plot_end = date2num(df_plot.index[0]), date2num(df_plot.index[-1])
     
-    return divided_events
-def filter_events(events,df_plot,mgsc):
-    '''Filter faulty events.'''
-
-    event_indices = [int(e.lstrip('event')) for e in events]
-        
-    for event_label, event in events.items():
-        methods = [line['method'] for line in event]
-        unique_methods = set(methods)
-        all_times = [t for line in event for t in list(zip(*line['fitted points']))[0]]
-        all_diams = [d for line in event for d in list(zip(*line['fitted points']))[1]]
+    def is_valid(event):
+        methods = set(lines[line_id]['method'] for line_id in event)
         
         #events outside of the colormap
-        if all(df_plot.index[0] >= num2date(time).replace(tzinfo=None) or num2date(time).replace(tzinfo=None) >= df_plot.index[-1] for time in all_times):
-            event_indices.remove(int(event_label.lstrip('event')))
+        if not any(np.any((plot_start < arrays[line_id]['t_fit']) & (arrays[line_id]['t_fit'] < plot_end)) for line_id in event):
+            return False
         
         #only whites or only greens
-        elif unique_methods == {'MC'} or unique_methods == {'AT'}:
-            event_indices.remove(int(event_label.lstrip('event')))
+        if methods == {'MC'} or methods == {'AT'}:
+            return False
         
         #one black in lower diameters
-        elif len(event) == 1 and unique_methods == {'MF'} and all(d < mgsc for d in all_diams):
-            event_indices.remove(int(event_label.lstrip('event')))
-
-        elif len(event) < 1:
-            event_indices.remove(int(event_label.lstrip('event')))
-            
-    events = {f'event{event_num+1}': events[f'event{i}'] for event_num,i in enumerate(event_indices) if f'event{i}' in events}
+        if len(event) == 1 and methods == {'MF'} and np.all(arrays[event[0]]['d_fit'] < mgsc):
+            return False
+        return True
     
-    return events
+    return [event for event in events if is_valid(event)]
 
 ############## GROWTH RATE ESTIMATION ###############
 #growth rate estimation
@@ -489,14 +543,16 @@ def estimate_growth_rate(lines):
     max_gr = max(growth_rates)
     
     return weighted_avg_gr, min_gr, max_gr
-def add_event_info(events):
+def add_event_info(all_lines,event_ids):
     '''
     Calculates growth rates for growth events and includes an estimate of 
     the reliability of the result. Classifies events to different situations 
     that affect the weighted average.
+    Returns dictionary of events (event1, event2, ...) with their lines.
     '''
+    events = {}
 
-    for i, lines in enumerate(events.values()):
+    for i, lines in enumerate([all_lines[line_id] for line_id in event] for event in event_ids):
         #estimate growth rates
         weighted_avg_gr, min_gr, max_gr = estimate_growth_rate(lines)
         
@@ -552,63 +608,82 @@ def init_events(df_data,df_plot,MF_gr_points,MC_gr_points,AT_gr_points,mc_area_e
     events = {'event1': {'lines': [...], 'avg growth rate': ..., etc. }, 'event2': {etc.}}
     '''
     
-    #find events
-    all_events = detect_events(df_data,MF_gr_points,MC_gr_points,AT_gr_points,mc_area_edges,mgsc)
-    final_events = split_events(all_events)
+    #find events (lists of line IDs)
+    lines, all_events = detect_events(df_data,MF_gr_points,MC_gr_points,AT_gr_points,mc_area_edges,mgsc)
+    arrays = line_arrays(lines)
+    final_events = split_events(lines,all_events,arrays)
     
     #filter events
-    all_events = filter_events(all_events,df_plot,mgsc)
-    final_events = filter_events(final_events,df_plot,mgsc)
+    all_events = filter_events(lines,all_events,arrays,df_plot,mgsc)
+    final_events = filter_events(lines,final_events,arrays,df_plot,mgsc)
 
     #add more info
-    all_events = add_event_info(all_events)
-    final_events = add_event_info(final_events)
+    all_events = add_event_info(lines,all_events)
+    final_events = add_event_info(lines,final_events)
 
     return all_events, final_events
         
-def timestamp_info(events):
+def timestamp_slots(events):
     '''
-    Similar to event_info, but for every timestamp in an event.
-    Format of results: 
-    ts_info = {'event1': {ts1: {'lines': [...], 'avg growth rate': ..., etc. }, ts2: etc.}, 'event2': {etc.}}
+    Lines and estimated growth rates in every timestamp (:15 and :45) of events, produced lazily.
+    Start and end times of lines are sorted once and lines in each timestamp are found with a sweep,
+    growth rate is estimated again only when lines of the timestamp change.
+    Lines are copied once per event (without points) and shared by its timestamps.
+    Yields (event_label, stamps), stamps yields (ts, {'lines': [...], 'avg growth rate': ..., etc.})
     '''
-    
-    ts_info = {}
+    def stamps(event):
+        #copies of lines without unnecessary info (points)
+        lines = [{key: (list(value) if isinstance(value,list) else value) for key,value in line.items() if key != 'points'}
+                 for line in event['lines']]
+        starts = np.array([min(t for t,d in line['fitted points']) for line in lines])
+        ends = np.array([max(t for t,d in line['fitted points']) for line in lines])
 
-    for event_label,event in events.items():
         #create a timestamp list with rounded times to :15 or :45
-        all_ts = [t for line in event['lines'] for t in list(zip(*line['fitted points']))[0]]
-
-        #convert to datetime and round
-        min_ts = num2date(min(all_ts)).replace(tzinfo=None)
-        max_ts = num2date(max(all_ts)).replace(tzinfo=None)
-        min_ts = round_up_to_quarter(min_ts)
-        max_ts = round_down_to_quarter(max_ts)
-
+        min_ts = round_up_to_quarter(num2date(starts.min()).replace(tzinfo=None))
+        max_ts = round_down_to_quarter(num2date(ends.max()).replace(tzinfo=None))
         even_ts = []
         while min_ts <= max_ts:
             even_ts.append(min_ts)
             min_ts += timedelta(minutes=30)
-
-        stamps = {}
-        for ts in even_ts:
-            #lines in this timestamp
-            lines_in_ts = [deepcopy(line) for line in event['lines'] if min(list(zip(*line['fitted points']))[0]) <= date2num(ts) <= max(list(zip(*line['fitted points']))[0])]
-            [line.pop('points',None) for line in lines_in_ts] #delete unnecessary info (points)
-            
-            #estimate average growth rate
-            if len(lines_in_ts) >= 2:
-                weighted_avg_gr, min_gr, max_gr = estimate_growth_rate(lines_in_ts)
-            else:
-                weighted_avg_gr, min_gr, max_gr = None, None, None
-                
-            #store info
-            stamps.update({ts.strftime('%Y-%m-%d %H:%M:%S'): 
-                                {'lines': [deepcopy(line) for line in lines_in_ts], 
-                                "avg growth rate": weighted_avg_gr, "min growth rate": min_gr, "max growth rate": max_gr}, 
-                           })
+        if not even_ts:
+            return
         
-        #fill dictonary
-        ts_info[event_label] = stamps
-      
-    return ts_info
\ No newline at end of file
+        #first timestamp of each line and the timestamp after its last one
+        ts_days = date2num(even_ts)
+        first = np.searchsorted(ts_days, starts, side='left')
+        after_last = np.searchsorted(ts_days, ends, side='right')
+        start_order = np.argsort(first, kind='stable')
+        end_order = np.argsort(after_last, kind='stable')
+        
+        active = set()
+        line_ids = None
+        i = j = 0
+        for k,ts in enumerate(even_ts):
+            while i < len(lines) and first[start_order[i]] == k:
+                active.add(start_order[i])
+                i += 1
+            while j < len(lines) and after_last[end_order[j]] == k:
+                active.discard(end_order[j])
+                j += 1
+            
+            #estimate average growth rate when lines change
+            if line_ids != sorted(active):
+                line_ids = sorted(active)
+                lines_in_ts = [lines[line_id] for line_id in line_ids]
+                if len(lines_in_ts) >= 2:
+                    weighted_avg_gr, min_gr, max_gr = estimate_growth_rate(lines_in_ts)
+                else:
+                    weighted_avg_gr, min_gr, max_gr = None, None, None
+            
+            yield ts.strftime('%Y-%m-%d %H:%M:%S'), {'lines': list(lines_in_ts), 
+                   "avg growth rate": weighted_avg_gr, "min growth rate": min_gr, "max growth rate": max_gr}
+    
+    for event_label,event in events.items():
+        yield event_label, stamps(event)
+def timestamp_info(events):
+    '''
+    Similar to event_info, but for every timestamp in an event (see timestamp_slots).
+    Format of results: 
+    ts_info = {'event1': {ts1: {'lines': [...], 'avg growth rate': ..., etc. }, ts2: etc.}, 'event2': {etc.}}
+    '''
+    return {event_label: dict(stamps) for event_label,stamps in timestamp_slots(events)}
@@ -0,0 +1,58 @@
+from collections import defaultdict
+from linear_fits import line_sums, add_point, remove_point
+
+'''
+Bookkeeping of unfinished growth lines for the find_growth functions.
+Lines get integer IDs in the order they are started, and a point→line ID map
+replaces scanning every line for a datapoint. Least squares sums of each
+line are updated in place with the points.
+
+Format of tracker:
+tracker = {'lines': {id: [point1,point2,...]}, 'point_lines': {point: {id,...}}, 'sums': {id: sums}, ...}
+'''
+
+def init_tracker(to_xy):
+    '''
+    Creates an empty tracker.
+    to_xy = function that returns x and y values of a point for linear fitting
+    '''
+    return {'lines': {}, 'point_lines': defaultdict(set), 'sums': {}, 'next_id': 0, 'to_xy': to_xy}
+def lines_with_point(tracker,point):
+    '''IDs of lines that include the datapoint, in the order the lines were started.'''
+    return sorted(tracker['point_lines'].get(point,()))
+def line_count(tracker,point):
+    '''Calculates in how many lines a datapoint is.'''
+    return len(tracker['point_lines'].get(point,()))
+
+def new_line(tracker,points):
+    '''Starts a new line. Returns ID of the line.'''
+    line_id = tracker['next_id']
+    tracker['next_id'] += 1
+
+    tracker['lines'][line_id] = list(points)
+    for point in points:
+        tracker['point_lines'][point].add(line_id)
+    tracker['sums'][line_id] = line_sums(*zip(*[tracker['to_xy'](point) for point in points]))
+    return line_id
+def extend_line(tracker,line_id,point):
+    '''Adds datapoint to the end of a line.'''
+    tracker['lines'][line_id].append(point)
+    tracker['point_lines'][point].add(line_id)
+    tracker['sums'][line_id] = add_point(tracker['sums'][line_id],*tracker['to_xy'](point))
+def drop_first(tracker,line_id):
+    '''Removes first datapoint of a line.'''
+    point = tracker['lines'][line_id].pop(0)
+    _forget_point(tracker,point,line_id)
+    tracker['sums'][line_id] = remove_point(tracker['sums'][line_id],*tracker['to_xy'](point))
+def remove_line(tracker,line_id):
+    '''Removes line from the tracker. Returns its datapoints.'''
+    points = tracker['lines'].pop(line_id)
+    for point in points:
+        _forget_point(tracker,point,line_id)
+    del tracker['sums'][line_id]
+    return points
+def _forget_point(tracker,point,line_id):
+    line_ids = tracker['point_lines'][point]
+    line_ids.discard(line_id)
+    if not line_ids:
+        del tracker['point_lines'][point]
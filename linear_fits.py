@@ -0,0 +1,150 @@
+import numpy as np
+
+'''
+Closed-form least squares for the linear model y = k*x + b.
+Lines are described by their sums [x_ref, n, Σu, Σy, Σuy, Σu²] where u = x - x_ref,
+so adding or dropping a point only adds or subtracts the sums of that point.
+x is taken relative to the first point of the line (x_ref), because sums of
+large x (e.g. days since 1970) lose the spread of x to rounding.
+'''
+
+################## LINE SUMS ########################
+def point_sums(x,y,x_ref=0.0):
+    '''Sums [n, Σu, Σy, Σuy, Σu²] of single datapoint(s). With arrays the shape is (5, number of points).'''
+    u = np.asarray(x,dtype=float) - x_ref
+    y = np.asarray(y,dtype=float)
+    return np.array([np.ones_like(u), u, y, u*y, u*u])
+def line_sums(x,y):
+    '''Sums of all datapoints in a line, relative to its first point.'''
+    x_ref = float(np.ravel(np.asarray(x,dtype=float))[0])
+    return np.r_[x_ref, point_sums(x,y,x_ref).reshape(5,-1).sum(axis=1)]
+def add_point(sums,x,y):
+    '''Sums of a line after adding a datapoint.'''
+    return np.r_[sums[0], sums[1:] + point_sums(x,y,sums[0])]
+def remove_point(sums,x,y):
+    '''Sums of a line after dropping a datapoint.'''
+    return np.r_[sums[0], sums[1:] - point_sums(x,y,sums[0])]
+
+##################### FITTING #######################
+def fit_sums(sums):
+    '''
+    Least squares slope and intercept from line sums.
+    Sums with shape (6, m) give m fits at once.
+    '''
+    x_ref = sums[0]
+    k, b_ref = _fit_relative(sums[1:])
+    return k, b_ref - k*x_ref
+def fit_line(x,y):
+    '''Least squares fit of datapoints in a line. Returns (k,b) like curve_fit.'''
+    return fit_sums(line_sums(x,y))
+def fit_candidates(x,y,x_new,y_new,sums=None):
+    '''
+    Fits the line separately with each candidate point added to it.
+    All candidates are fitted in one vectorized pass.
+    Returns slopes, intercepts and the x, y and residuals of all fits (candidates × points).
+    
+    sums = sums of the line if already known
+    '''
+    x = np.asarray(x,dtype=float)
+    y = np.asarray(y,dtype=float)
+    x_new = np.asarray(x_new,dtype=float)
+    y_new = np.asarray(y_new,dtype=float)
+    if sums is None:
+        sums = line_sums(x,y)
+    x_ref = sums[0]
+
+    k, b_ref = _fit_relative(sums[1:,None] + point_sums(x_new,y_new,x_ref))
+
+    #points of every fit, candidate point last
+    x_all = np.column_stack([np.broadcast_to(x,(len(x_new),len(x))), x_new])
+    y_all = np.column_stack([np.broadcast_to(y,(len(y_new),len(y))), y_new])
+    residuals = y_all - (k[:,None]*(x_all - x_ref) + b_ref[:,None])
+
+    return k, b_ref - k*x_ref, x_all, y_all, residuals
+def _fit_relative(sums):
+    n, su, sy, suy, suu = sums
+    k = (n*suy - su*sy) / (n*suu - su**2)
+    b = (sy - k*su) / n
+    return k, b
+
+################## ROBUST FITTING ###################
+def huber_rho(z,t=1.345):
+    '''Huber's T criterion function.'''
+    return np.where(np.abs(z) <= t, 0.5*z**2, np.abs(z)*t - 0.5*t**2)
+def huber_weights(z,t=1.345):
+    '''Huber's T weights for IRLS.'''
+    abs_z = np.abs(z)
+    return np.where(abs_z <= t, 1.0, t/np.where(abs_z <= t, 1.0, abs_z))
+def robust_fit_lines(xs,ys,maxiter=50,tol=1e-8):
+    '''
+    Robust linear regression with HuberT weighting for many lines at once.
+    Iteratively reweighted least squares on zero padded arrays (lines × points),
+    follows statsmodels RLM defaults (MAD scale, deviance convergence).
+    Returns list of (x_linear, y_predicted, params) where params = [b,k].
+    '''
+    if not xs:
+        return []
+    
+    #pad lines to the same length
+    lengths = np.array([len(y) for y in ys])
+    mask = np.arange(lengths.max()) < lengths[:,None]
+    x = np.zeros(mask.shape)
+    y = np.zeros(mask.shape)
+    x[mask] = np.concatenate([np.asarray(line_x,dtype=float) for line_x in xs])
+    x_ref = x[:,0] #x relative to first point of each line
+    x = np.where(mask, x - x_ref[:,None], 0)
+    y[mask] = np.concatenate([np.asarray(line_y,dtype=float) for line_y in ys])
+    df_resid = lengths - 2
+    rows = np.arange(len(lengths))
+
+    def wls(weights):
+        '''Weighted least squares fit of every line.'''
+        w = weights * mask
+        sums = np.array([w.sum(axis=1), (w*x).sum(axis=1), (w*y).sum(axis=1), (w*x*y).sum(axis=1), (w*x*x).sum(axis=1)])
+        k, b = _fit_relative(sums)
+        resid = np.where(mask, y - (k[:,None]*x + b[:,None]), 0)
+        wls_scale = (w*resid**2).sum(axis=1) / df_resid
+        return k, b, resid, wls_scale
+    def mad(resid):
+        '''Median absolute deviation around zero.'''
+        abs_resid = np.sort(np.where(mask, np.abs(resid), np.inf), axis=1) #padding sorted last
+        median = 0.5 * (abs_resid[rows,(lengths-1)//2] + abs_resid[rows,lengths//2])
+        return median / 0.6744897501960817
+    def deviance(resid,wls_scale):
+        return np.where(mask, huber_rho(resid/wls_scale[:,None]), 0).sum(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        #ordinary least squares as starting point
+        k, b, resid, wls_scale = wls(np.ones(mask.shape))
+        scale = mad(resid)
+        dev = deviance(resid,wls_scale)
+        converged = np.zeros(len(xs),dtype=bool)
+        
+        iteration = 1
+        while not converged.all():
+            converged |= scale == 0.0 #perfect fit
+            active = ~converged
+
+            weights = huber_weights(resid/scale[:,None])
+            k_new, b_new, resid_new, wls_scale_new = wls(weights)
+            dev_new = deviance(resid_new,wls_scale_new)
+
+            #update only lines that have not converged
+            k = np.where(active, k_new, k)
+            b = np.where(active, b_new, b)
+            resid = np.where(active[:,None], resid_new, resid)
+            scale = np.where(active, mad(resid_new), scale)
+            
+            iteration += 1
+            converged |= active & ~(np.abs(dev_new - dev) > tol)
+            dev = np.where(active, dev_new, dev)
+            if iteration >= maxiter:
+                break
+
+    #predict data of estimated models
+    results = []
+    for i, line_x in enumerate(xs):
+        x_linear = np.linspace(np.min(line_x), np.max(line_x), num=lengths[i])
+        params = np.array([b[i] - k[i]*x_ref[i],k[i]])
+        results.append((x_linear, b[i] + k[i]*(x_linear - x_ref[i]), params))
+    return results
@@ -3,16 +3,18 @@
 
 # automatic growth rate calculator #
 
+import numpy as np
 import pandas as pd
 import json
-import matplotlib.pyplot as plt
-from matplotlib import use, colors
-from matplotlib.dates import set_epoch, num2date
-from scipy.optimize import OptimizeWarning
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+from matplotlib import rcParams
+from matplotlib.dates import set_epoch, get_epoch, num2date
 from warnings import simplefilter
 from datetime import timedelta, datetime
 from time import time
-from xarray import open_dataset
+import data_cache
 
 '''
 abbreviations:
@@ -24,24 +26,36 @@ def main():
     file_name = "Beijing.nc" #in the same folder as this code
     start_date = "2004-09-20" #YYYY-MM-DD HH:MM:SS (time of day is optional)
     end_date = "2004-09-22"   
+    use_loader_cache = True #True to save loaded data (folder loader_cache) and reuse it when loading the same file and time period again
+    
+    ## BATCH ##
+    batch_windows = [] #time periods [(start_date, end_date), ...] processed in parallel instead of start_date-end_date, e.g. date_windows("2004-09-01","2004-09-30")
+                       #results of each period are saved to a file (no plotting), empty list ([]) to process only start_date-end_date
+    batch_workers = None #number of processes for batch windows (None = all CPUs)
+    batch_output_dir = "batch_results" #folder of result files
     
     ## PARAMETERS ##
-    # mode fitting #
-    fit_multimodes = False #True if the fit_results -file does not yet exist for your time period
-    mape_threshold_factor = 15 #a*x^(-1) (constant 'a' that determines mean average error thresholds for different line lengths)
-    gr_error_threshold_MF = 60 #% (precentage error of growth rates when adding new points to lines)
-    
-    # maximum concentration and appearance time #
-    #peak areas
-    maximum_peak_difference = 2 #hours (max time between two peaks in smoothed data (window 3))
-    derivative_threshold = 200 #cm^(-3)/h (starts of horizontal peak areas, determines the appearance of a possible event) 
-                                    #(NOTICE: concentration diff is half of this between timesteps as the resolution is 30min)
-    
-    #find_growth
-    mae_threshold_factor = 1 #a*x^(-1) (constant 'a' that determines mean average error thresholds for different line lengths)
-    gr_error_threshold_MCAT = 60 #% (precentage error of growth rates when adding new points to lines)
-    maximum_diameter_channel = 60 #nm (highest diameter channel where growth lines are extended)
-    maximum_growth_start_channel = 40 #nm (highest diameter channel where growth lines are allowed to start)
+    parameters = {
+        # mode fitting #
+        'fit_multimodes': False, #True to fit all timestamps again (timestamps missing from the mode fitting cache are always fitted)
+        'save_modefits': True, #True to save new mode fitting results to the cache (folder modefit_cache) for later runs
+        'workers': None, #number of processes shared by mode fitting and appearance time fits (None = all CPUs for mode fitting, no pool for appearance times)
+                         #mode fitting runs in parallel with maximum concentration and appearance time unless 1
+        'mape_threshold_factor': 15, #a*x^(-1) (constant 'a' that determines mean average error thresholds for different line lengths)
+        'gr_error_threshold_MF': 60, #% (precentage error of growth rates when adding new points to lines)
+        
+        # maximum concentration and appearance time #
+        #peak areas
+        'maximum_peak_difference': 2, #hours (max time between two peaks in smoothed data (window 3))
+        'derivative_threshold': 200, #cm^(-3)/h (starts of horizontal peak areas, determines the appearance of a possible event) 
+                                     #(NOTICE: concentration diff is half of this between timesteps as the resolution is 30min)
+        
+        #find_growth
+        'mae_threshold_factor': 1, #a*x^(-1) (constant 'a' that determines mean average error thresholds for different line lengths)
+        'gr_error_threshold_MCAT': 60, #% (precentage error of growth rates when adding new points to lines)
+        'maximum_diameter_channel': 60, #nm (highest diameter channel where growth lines are extended)
+        'maximum_growth_start_channel': 40 #nm (highest diameter channel where growth lines are allowed to start)
+    }
     
     #channel plotting (maximum concentration and appearance time)
     channel_indices = [] #Indices of diameter channels (1=small), empty list ([]) if no channels plotted
@@ -50,6 +64,7 @@ def main():
     
     
     ## RESULTS ##
+    headless = False #True to run without plotting (no GUI backend or matplotlib.pyplot is loaded, results can still be printed and saved)
     result_config = {
         'plot_all_points': False, #plots all points for all methods
         'plot_all_lines': False, #plots all lines 
@@ -68,62 +83,215 @@ def main():
     
     ##############################################################################################
 
+    ## BATCH PROCESSING ##
+    if batch_windows:
+        run_batch(file_name,batch_windows,parameters,use_loader_cache,batch_output_dir,batch_workers)
+        return
+
     ## LOAD DATA ##
-    df,df_plot = load_NC_data(file_name,start_date,end_date)
+    if use_loader_cache:
+        df,df_plot = data_cache.load_cached(load_NC_data,file_name,start_date,end_date)
+    else:
+        df,df_plot = load_NC_data(file_name,start_date,end_date)
     #print(df)
     
     ## CONFIGURATIONS ##
-    use("Qt5Agg") #backend changes the UI for plotting
+    if not headless:
+        from matplotlib import use
+        use("Qt5Agg") #backend changes the UI for plotting
+    from scipy.optimize import OptimizeWarning
     simplefilter("ignore",OptimizeWarning) #supress warnings for curve_fit to avoid crowding of terminal!!
     simplefilter("ignore",RuntimeWarning)
     set_epoch(start_date) #set epoch
 
     ## CALLING FUNCTIONS ##
+    results = run_window(df,file_name,parameters) #steps 1-4
+    
+    # Step 5: Results
+    show_results(file_name,start_date,df,df_plot,results,result_config,parameters['maximum_growth_start_channel'],headless)
+    if headless:
+        return
+    if channel_indices:
+        import maxcon_appeartime
+        maxcon_appeartime.plot_channel(df_plot,channel_indices,parameters['maximum_peak_difference'],
+                                       parameters['maximum_diameter_channel'],parameters['derivative_threshold'],
+                                       show_start_times_and_maxima,df_methods=df) #reuses results of step 3
+    import matplotlib.pyplot as plt
+    plt.show()
+def log_step(message, start_time, step_num, total_steps=4):
+    '''Prints progress of a step and returns the start time of the next step.'''
+    print(f"{message} ({step_num}/{total_steps}) ({time() - start_time:.2f} seconds)")
+    return time()
+def mode_fitting_branch(df,file_name,parameters,new_modefits=None):
+    '''
+    Finds mode fitting peaks and their growth periods (steps 1-2).
+    Returns dict of results and new_modefits (see run_window).
+    '''
     import modefitting_peaks
     import modefitting_GR
-    import maxcon_appeartime
-    
-    def log_step(message, start_time, step_num, total_steps=4):
-        print(f"{message} ({step_num}/{total_steps}) ({time() - start_time:.2f} seconds)")
-        return time()
     print('\n'+'******** Processing mode fitting data'+'\n')
     st = time() #progress 
+    results = {}
     
     # Step 1: Find mode fitting peaks
-    df_MF_peaks = modefitting_peaks.find_peaks(df,file_name,start_date,fit_multimodes)
+    results['df_MF_peaks'] = modefitting_peaks.find_peaks(df,file_name,parameters['fit_multimodes'],save_fits=parameters['save_modefits'],
+                                                          workers=parameters['workers'],new_fits=new_modefits)
     st = log_step("Peaks found!", st, 1)
     
     # Step 2: Find periods of growth
-    MF_gr_points = modefitting_GR.find_growth(df_MF_peaks,a=mape_threshold_factor,gret=gr_error_threshold_MF)
+    results['MF_gr_points'] = modefitting_GR.find_growth(results['df_MF_peaks'],a=parameters['mape_threshold_factor'],gret=parameters['gr_error_threshold_MF'])
     st = log_step("Growth periods found!", st, 2)
     
-    # Step 3: Find maximum concentration peaks and appearance times
+    return results, new_modefits
+def maxcon_branch(df,parameters):
+    '''Finds maximum concentration peaks, appearance times and their growth periods (steps 3-4). Returns dict of results.'''
+    import maxcon_appeartime
     print('\n'+'******** Processing maximum concentration and appearance time data'+'\n')
-    df_MC, df_AT, df_DT, incomplete_MC, incomplete_AT, mc_area_edges, *_ = maxcon_appeartime.init_methods(
-        df,mpd=maximum_peak_difference,mdc=maximum_diameter_channel,derivative_threshold=derivative_threshold)
+    st = time() #progress 
+    results = {}
+    
+    # Step 3: Find maximum concentration peaks and appearance times
+    results['df_MC'], results['df_AT'], results['df_DT'], results['incomplete_MC'], results['incomplete_AT'], results['mc_area_edges'], *_ = \
+        maxcon_appeartime.init_methods(df,mpd=parameters['maximum_peak_difference'],mdc=parameters['maximum_diameter_channel'],
+                                       derivative_threshold=parameters['derivative_threshold'],workers=parameters['workers'])
     st = log_step("Peaks found!", st, 3)
     
     # Step 4: Find their growth periods
-    MC_gr_points, AT_gr_points = maxcon_appeartime.init_find(
-        df,df_MC,df_AT,mgsc=maximum_growth_start_channel,a=mae_threshold_factor,gret=gr_error_threshold_MCAT)
+    results['MC_gr_points'], results['AT_gr_points'] = maxcon_appeartime.init_find(
+        df,results['df_MC'],results['df_AT'],mgsc=parameters['maximum_growth_start_channel'],
+        a=parameters['mae_threshold_factor'],gret=parameters['gr_error_threshold_MCAT'])
     st = log_step("Growth periods found!", st, 4)
 
-    # Step 5: Results
-    show_results(file_name,start_date,df,df_plot,df_MF_peaks,MF_gr_points,df_MC,incomplete_MC,MC_gr_points,
-                 df_AT,incomplete_AT,AT_gr_points,df_DT,mc_area_edges,result_config,maximum_growth_start_channel)
-    if channel_indices:
-        maxcon_appeartime.plot_channel(df_plot,channel_indices,maximum_peak_difference,
-                                       maximum_diameter_channel,derivative_threshold,show_start_times_and_maxima)
-    plt.show()
+    return results
+def run_window(df,file_name,parameters,new_modefits=None):
+    '''
+    Finds growth periods with all methods (steps 1-4) in loaded data.
+    Mode fitting (steps 1-2) runs in another process at the same time as maximum
+    concentration and appearance time (steps 3-4) unless parameters['workers'] is 1.
+    Steps 3-4 run in this process so their results stay cached for plot_channel.
+    The processes are split between the branches, appearance time fits get half
+    of them if parameters['workers'] is given and otherwise run without a pool.
+
+    parameters = dict of method parameters (see main)
+    new_modefits = list that new mode fits are collected to instead of saving them (see modefitting_peaks.find_peaks)
+    Returns dict of results.
+    '''
+    workers = parameters['workers'] or os.cpu_count() or 1
+    if workers == 1:
+        results, _ = mode_fitting_branch(df,file_name,parameters,new_modefits)
+        results.update(maxcon_branch(df,parameters))
+        return results
+    
+    #split processes between the branches
+    maxcon_workers = max(workers//2,1) if parameters['workers'] else 1
+    mf_parameters = dict(parameters, workers=max(workers - maxcon_workers,1))
+    maxcon_parameters = dict(parameters, workers=maxcon_workers)
+    
+    with ProcessPoolExecutor(max_workers=1, initializer=init_worker, initargs=(get_epoch(),)) as executor:
+        mode_fitting = executor.submit(mode_fitting_branch,df,file_name,mf_parameters,None if new_modefits is None else [])
+        maxcon_results = maxcon_branch(df,maxcon_parameters)
+        results, mf_new_modefits = mode_fitting.result()
+    
+    results.update(maxcon_results)
+    if new_modefits is not None:
+        new_modefits.extend(mf_new_modefits)
+    return results
+def find_events(df,df_plot,results,mgsc):
+    '''Combines growth periods of all methods to events. Returns all events and final events.'''
+    import growth_events
+    return growth_events.init_events(df,df_plot,results['MF_gr_points'],results['MC_gr_points'],
+                                     results['AT_gr_points'],results['mc_area_edges'],mgsc)
 
 ##################################################################################################
 
-def load_AVAA_data(file_name,start_date,end_date):
+def date_windows(start_date,end_date,days=1):
+    '''Splits time period to windows of given number of days. Returns list of (start_date, end_date).'''
+    last_day = pd.Timestamp(end_date)
+    return [(start.strftime("%Y-%m-%d"), min(start + timedelta(days=days-1), last_day).strftime("%Y-%m-%d"))
+            for start in pd.date_range(start_date,end_date,freq=f'{days}D')]
+def init_worker(epoch):
+    '''
+    Settings of worker processes. The epoch is given as the default epoch of matplotlib
+    (rcParams), which also works in processes that already have it (started by fork).
+    '''
+    from scipy.optimize import OptimizeWarning
+    simplefilter("ignore",OptimizeWarning)
+    simplefilter("ignore",RuntimeWarning)
+    rcParams['date.epoch'] = epoch
+def process_window(file_name,window,parameters,use_loader_cache,output_dir):
+    '''
+    Finds growth events in one time period and saves them to a file.
+    Returns name of the file and new mode fits (saved by the main process).
+    '''
+    start_date, end_date = window
+    loader = load_NC_data if file_name.endswith('.nc') else load_AVAA_data
+    if use_loader_cache:
+        df,df_plot = data_cache.load_cached(loader,file_name,start_date,end_date)
+    else:
+        df,df_plot = loader(file_name,start_date,end_date)
+    
+    new_modefits = []
+    results = run_window(df,file_name,parameters,new_modefits)
+    all_events, final_events = find_events(df,df_plot,results,parameters['maximum_growth_start_channel'])
+    import growth_events
+    ts_info = growth_events.timestamp_info(all_events)
+
+    name = os.path.splitext(os.path.basename(file_name))[0]
+    output_file_name = os.path.join(output_dir, f"{name}_{start_date}_{end_date}.json".replace(' ','_').replace(':',''))
+    with open(output_file_name, 'w') as output_file:
+        json.dump({'file name': file_name, 'start date': start_date, 'end date': end_date,
+                   'final events': events_to_dates(final_events), 'timestamp info': ts_info_to_dates(ts_info)}, output_file, indent=2)
+    return output_file_name, new_modefits
+def run_batch(file_name,windows,parameters,use_loader_cache=True,output_dir='batch_results',workers=None):
+    '''
+    Processes many time periods of a dataset in parallel (one process per window at a time).
+    Each process keeps the dataset open for all of its windows, results are saved to a file per window.
+    New mode fits are saved to the cache only by this process.
+
+    windows = list of (start_date, end_date), e.g. date_windows(...)
+    workers = number of processes (default: number of CPUs, 1 = no pool)
+    '''
+    import modefitting_peaks
+    workers = min(workers or os.cpu_count() or 1, len(windows))
+    parameters = dict(parameters, workers=max((os.cpu_count() or 1) // workers, 1)) #CPUs left for each window
+    os.makedirs(output_dir, exist_ok=True)
+    data_cache.file_hash(file_name) #hash once before processes use it
+    
+    def finish(window,result):
+        #save new mode fits of a processed window, failed windows are skipped
+        try:
+            output_file_name, new_modefits = result()
+        except (Exception, SystemExit) as error:
+            print(f"ERROR: Time period {window[0]} - {window[1]} failed! ({error!r})")
+            return
+        if parameters['save_modefits'] and new_modefits:
+            modefitting_peaks.save_new_fits(file_name,new_modefits)
+        print(f"Saved {output_file_name}")
+    
+    st = time()
+    if workers == 1:
+        init_worker(windows[0][0])
+        for window in windows:
+            finish(window,partial(process_window,file_name,window,parameters,use_loader_cache,output_dir))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(windows[0][0],)) as executor:
+            futures = {executor.submit(process_window,file_name,window,parameters,use_loader_cache,output_dir): window for window in windows}
+            for future in as_completed(futures):
+                finish(futures[future],future.result)
+    print(f"Processed {len(windows)} time periods ({time() - st:.2f} seconds)")
+
+##################################################################################################
+
+def load_AVAA_data(file_name,start_date,end_date,chunksize=100000):
     '''
     Loads data downloaded from AVAA platforms (SmartSMEAR).
     In case tar-data is not available.
     Time in days & diameters in X*e^Y format 
     (e.g. "HYY_DMPS.d112e2" where diameter is 11.2nm)
+
+    The file is read in chunks and only rows of the time period are kept.
+    df_plot is a view of the plotting period in df (no copy of the data).
+    chunksize = number of rows read at once
     '''
     def process_df(dataframe):
         #round data to nearest 30min and shift times by 15minutes forward
@@ -131,50 +299,73 @@ def load_AVAA_data(file_name,start_date,end_date):
         dataframe.index = dataframe.index.round("30min")
         dataframe = dataframe.shift(periods=15, freq='Min')
 
-        #put diameter bins in order
-        sorted_columns = sorted(dataframe.columns, key=lambda column: (int(column.split('e')[-1]) , int(column[10:13])))
-        dataframe = dataframe[sorted_columns]
-
-        #replace arbitrary column names by diameter float values
-        diameter_ints = []
-        for column_str in sorted_columns:
-            number = column_str[10:13]
-            decimal_pos = int(column_str[-1])
-            column_float = float(number[:decimal_pos] + '.' + number[decimal_pos:])
-            diameter_ints.append(column_float)
-        diameter_ints[-1] = 1000.0 #set last bin as 1000
-        dataframe.columns = diameter_ints
+        #put diameter bins in order and replace arbitrary column names by diameter float values
+        if np.any(column_order != np.arange(len(column_order))):
+            dataframe = dataframe.iloc[:,column_order]
+        return dataframe.set_axis(diameters, axis=1), original_timestamps
+    def parse_times(chunk):
+        #timestamps from time columns
+        times = ((chunk['Year'].to_numpy(dtype=np.int64) - 1970).astype('M8[Y]').astype('M8[M]')
+                 + (chunk['Month'].to_numpy(dtype=np.int64) - 1).astype('m8[M]')).astype('M8[ns]')
+        times += (chunk['Day'].to_numpy(dtype=np.int64) - 1).astype('m8[D]')
+        times += chunk['Hour'].to_numpy(dtype=np.int64).astype('m8[h]')
+        times += chunk['Minute'].to_numpy(dtype=np.int64).astype('m8[m]')
+        times += np.round(chunk['Second'].to_numpy(dtype=float) * 1e9).astype(np.int64).astype('m8[ns]')
+        return pd.DatetimeIndex(times, name='timestamp')
+    
+    #time period with half day before and after for gr calculations
+    try:
+        padded_start = datetime.strptime(start_date, "%Y-%m-%d %H:%M:%S") - timedelta(hours=12)
+        padded_end = datetime.strptime(end_date, "%Y-%m-%d %H:%M:%S") + timedelta(hours=12)
+    except ValueError:
+        padded_start = datetime.strptime(start_date, "%Y-%m-%d") - timedelta(hours=12)
+        padded_end = datetime.strptime(f'{end_date} 23:59:59', "%Y-%m-%d %H:%M:%S") + timedelta(hours=12)
+
+    #read time period in chunks with the C parser
+    time_columns = ['Year','Month','Day','Hour','Minute','Second']
+    header = pd.read_csv(file_name, sep=',', nrows=0).columns
+    data_columns = [column for column in header if column not in time_columns]
+    chunks = []
+    has_data = np.zeros(len(data_columns), dtype=bool) #bins with data anywhere in the file
+    first_time = last_time = None
+
+    for chunk in pd.read_csv(file_name, sep=',', engine='c', chunksize=chunksize,
+                             dtype={column: np.float64 for column in header}):
+        times = parse_times(chunk)
+        values = chunk[data_columns].to_numpy()
+        has_data |= ~np.isnan(values).all(axis=0)
+        first_time = times[0] if first_time is None else first_time
+        last_time = times[-1]
         
-        return dataframe, original_timestamps
-    
-    #load data and convert time columns to timestamps
-    df = pd.DataFrame(pd.read_csv(file_name,sep=',',engine='python'))
-    df['timestamp'] = pd.to_datetime(df[['Year', 'Month', 'Day', 'Hour', 'Minute', 'Second']])
-    df = df.set_index('timestamp')
-    df = df.drop(['Year','Month','Day','Hour','Minute','Second'], axis=1)
+        in_period = (times >= padded_start) & (times <= padded_end)
+        if in_period.any():
+            chunks.append(pd.DataFrame(values[in_period], index=times[in_period], columns=data_columns))
+    df = pd.concat(chunks) if chunks else pd.DataFrame(columns=data_columns, index=pd.DatetimeIndex([], name='timestamp'), dtype=float)
 
     #drop bins with no data
-    df = df.dropna(axis=1, how='all')
+    df = df.loc[:, has_data]
     
     #print time period
-    print("start of period:",df.index[0].strftime("%Y-%m-%d %H:%M"))
-    print("end of period:",df.index[-1].strftime("%Y-%m-%d %H:%M"))
-    
-    #select wanted time period
-    df_plot = df.loc[start_date:end_date]
+    print("start of period:",first_time.strftime("%Y-%m-%d %H:%M"))
+    print("end of period:",last_time.strftime("%Y-%m-%d %H:%M"))
 
-    #include half day before and after for gr calculations
-    try:
-        start_date = datetime.strptime(start_date, "%Y-%m-%d %H:%M:%S") - timedelta(hours=12)
-        end_date = datetime.strptime(end_date, "%Y-%m-%d %H:%M:%S") + timedelta(hours=12)
-    except ValueError:
-        start_date = datetime.strptime(start_date, "%Y-%m-%d") - timedelta(hours=12)
-        end_date = datetime.strptime(f'{end_date} 23:59:59', "%Y-%m-%d %H:%M:%S") + timedelta(hours=12)
-         
-    df = df.loc[start_date:end_date]
-    
-    df, *_ = process_df(df)
-    df_plot, original_timestamps = process_df(df_plot)
+    #diameters from column names (vectorized), e.g. "HYY_DMPS.d112e2" -> 11.2
+    names = pd.Index(df.columns)
+    mantissas = names.str[10:13].astype(int).to_numpy()
+    exponents = names.str.split('e').str[-1].astype(int).to_numpy()
+    decimal_positions = names.str[-1].astype(int).to_numpy()
+    column_order = np.lexsort((mantissas, exponents)) #put diameter bins in order
+    decimals = np.maximum(3 - decimal_positions[column_order], 0)
+    diameters = mantissas[column_order] / 10.0**decimals
+    diameters[-1] = 1000.0 #set last bin as 1000
+    
+    #select wanted time period (rows of plotting period before rounding times)
+    df = df.loc[padded_start:padded_end]
+    plot_rows = df.index.slice_indexer(start_date,end_date)
+    
+    df, original_timestamps = process_df(df)
+    df_plot = df.iloc[plot_rows]
+    original_timestamps = original_timestamps[plot_rows]
 
     #check for duplicate timestamps
     if len(df.index) != len(set(df.index)):
@@ -183,19 +374,26 @@ def load_AVAA_data(file_name,start_date,end_date):
         raise SystemExit
     
     return df, df_plot
+open_datasets = {} #datasets opened by load_NC_data
 def load_NC_data(file_name,start_date,end_date):
     '''
     Loads data with nc format. 
+    df_plot is a view of the plotting period in df (no copy of the data).
+    The dataset stays open so that other time periods are loaded without opening it again.
     '''
     def assemble_df(subset):
         x = subset['time'].values
         y = subset['bin'].values * 10e8
         z_mean = subset.values
-        dataframe = pd.DataFrame(data=z_mean,index=x,columns=y)
-        dataframe = dataframe.dropna(axis=1, how='all') #drop bins with no data
-        return dataframe
-    
-    ds = open_dataset(file_name,engine='netcdf4')
+        has_data = ~np.isnan(z_mean).all(axis=0) #drop bins with no data
+        if not has_data.all():
+            z_mean, y = z_mean[:,has_data], y[has_data]
+        return pd.DataFrame(data=z_mean,index=x,columns=y,copy=False)
+    
+    if file_name not in open_datasets: #dataset is kept open for later time periods
+        from xarray import open_dataset #only needed for .nc files
+        open_datasets[file_name] = open_dataset(file_name,engine='netcdf4')
+    ds = open_datasets[file_name]
     data = ds['PNSD']
     
     #print time period
@@ -204,20 +402,15 @@ def load_NC_data(file_name,start_date,end_date):
     print("start of period:",first_time.strftime("%Y-%m-%d %H:%M"))
     print("end of period:",last_time.strftime("%Y-%m-%d %H:%M"))
     
-    #select time period
-    data_plotting = data.sel(time=slice(start_date, end_date)) #plotting
-    
     #include half day before and after for gr calculations
     try:
-        start_date = datetime.strptime(start_date, "%Y-%m-%d %H:%M:%S") - timedelta(hours=12)
-        end_date = datetime.strptime(end_date, "%Y-%m-%d %H:%M:%S") + timedelta(hours=12)
+        padded_start = datetime.strptime(start_date, "%Y-%m-%d %H:%M:%S") - timedelta(hours=12)
+        padded_end = datetime.strptime(end_date, "%Y-%m-%d %H:%M:%S") + timedelta(hours=12)
     except ValueError:
-        start_date = datetime.strptime(start_date, "%Y-%m-%d") - timedelta(hours=12)
-        end_date = datetime.strptime(f'{end_date} 23:59:59', "%Y-%m-%d %H:%M:%S") + timedelta(hours=12)
+        padded_start = datetime.strptime(start_date, "%Y-%m-%d") - timedelta(hours=12)
+        padded_end = datetime.strptime(f'{end_date} 23:59:59', "%Y-%m-%d %H:%M:%S") + timedelta(hours=12)
     
-    data_subset = data.sel(time=slice(start_date, end_date))
-    
-    df_plot = assemble_df(data_plotting) #df for plotting
+    data_subset = data.sel(time=slice(padded_start, padded_end))
     df = assemble_df(data_subset) #df for gr calculations
     
     #check for duplicate timestamps
@@ -225,18 +418,49 @@ def load_NC_data(file_name,start_date,end_date):
         print("ERROR: Multiple identical timestamps detected! Please make sure the data has been sampled evenly.")
         raise SystemExit
 
-    return df, df_plot
+    #select plotting period from df, bins with no data in the period are dropped
+    df_plot = df.loc[start_date:end_date] #plotting
+    has_data = df_plot.notna().any().to_numpy()
+    if not has_data.all():
+        df_plot = df_plot.loc[:,has_data]
 
+    return df, df_plot
 
-def show_results(file_name,start_date,df_data,df_plot,df_MF_peaks,MF_gr_points,df_MC,incomplete_MC,MC_gr_points,
-                 df_AT,incomplete_AT,AT_gr_points,df_DT,mc_area_edges,result_config,mgsc):
 
+def events_to_dates(events):
+    '''Changes times of points in lines of events from days to dates (type: str).'''
+    for event in events.values():
+        for line in event['lines']:
+            for key in ['points','fitted points']:
+                line[key] = [(num2date(point[0]).replace(tzinfo=None).strftime('%Y-%m-%d %H:%M:%S'),point[1])
+                             for point in line[key]]
+    return events
+def ts_info_to_dates(ts_info):
+    '''
+    Changes times of fitted points in timestamp info from days to dates (type: str).
+    Timestamps of an event share lines, so every line is changed once.
+    '''
+    lines = {id(line): line for event in ts_info.values() for ts in event.values() for line in ts['lines']}
+    for line in lines.values():
+        line['fitted points'] = [(num2date(point[0]).replace(tzinfo=None).strftime('%Y-%m-%d %H:%M:%S'),point[1])
+                                for point in line['fitted points']]
+    return ts_info
+def show_results(file_name,start_date,df_data,df_plot,results,result_config,mgsc,headless=False):
+    '''
+    Plots, prints and saves results as chosen in result_config.
+    results = results of run_window
+    headless = True to skip plotting (matplotlib.pyplot is not imported)
+    '''
+    df_MF_peaks, MF_gr_points, df_MC, incomplete_MC, MC_gr_points, df_AT, incomplete_AT, AT_gr_points, df_DT = (results[key] for key in
+        ['df_MF_peaks','MF_gr_points','df_MC','incomplete_MC','MC_gr_points','df_AT','incomplete_AT','AT_gr_points','df_DT'])
+    all_events, final_events = find_events(df_data,df_plot,results,mgsc)
     import growth_events
-    all_events, final_events = growth_events.init_events(df_data,df_plot,MF_gr_points,MC_gr_points,AT_gr_points,mc_area_edges,mgsc)
-    ts_info = growth_events.timestamp_info(all_events)
+    ts_info = growth_events.timestamp_info(all_events) if result_config['save_ts_info'] else None
 
-    if any([result_config['plot_all_points'],result_config['plot_all_lines'],result_config['plot_all_events'],
-            result_config['plot_final_events'],result_config['plot_DT']]):
+    if not headless and any([result_config['plot_all_points'],result_config['plot_all_lines'],result_config['plot_all_events'],
+                             result_config['plot_final_events'],result_config['plot_DT']]):
+        import matplotlib.pyplot as plt
+        from matplotlib import colors
         
         fig, ax = plt.subplots(figsize=(14, 5), dpi=200) #change graph size here!
 
@@ -420,10 +644,16 @@ def show_results(file_name,start_date,df_data,df_plot,df_MF_peaks,MF_gr_points,d
         print('\n'+'*'*70)
         print('Growth lines in each timestamp.')
         
-        for event_label,stamps in ts_info.items():
+        #timestamps are found while printing if they are not saved
+        if ts_info is None:
+            event_stamps = growth_events.timestamp_slots(all_events)
+        else:
+            event_stamps = ((event_label,stamps.items()) for event_label,stamps in ts_info.items())
+        
+        for event_label,stamps in event_stamps:
             print(f'\n{event_label}:')
             
-            for ts_label,ts in stamps.items():
+            for ts_label,ts in stamps:
                 print(f'{ts_label}:')
                 
                 for line in ts['lines']:
@@ -447,24 +677,12 @@ def show_results(file_name,start_date,df_data,df_plot,df_MF_peaks,MF_gr_points,d
     
     # SAVING #
     if result_config['save_final_event_info']:
-        #change days to dates (type: str)
-        for event in final_events.values():
-            for line in event['lines']:
-                for key in ['points','fitted points']:
-                    line[key] = [(num2date(point[0]).replace(tzinfo=None).strftime('%Y-%m-%d %H:%M:%S'),point[1])
-                                 for point in line[key]]
-        
+        events_to_dates(final_events)
         with open(f'{file_name[0:3]}{start_date[2:4]}{start_date[5:7]}{start_date[-2:]}_final_events.json', 'w') as output_file:
             json.dump(final_events, output_file, indent=2)
 
     if result_config['save_ts_info']:
-        #change days to dates (type: str)
-        for event in ts_info.values():
-            for ts in event.values():
-                for line in ts['lines']:
-                    line['fitted points'] = [(num2date(point[0]).replace(tzinfo=None).strftime('%Y-%m-%d %H:%M:%S'),point[1])
-                                    for point in line['fitted points']]
-        
+        ts_info_to_dates(ts_info)
         with open(f'{file_name[0:3]}{start_date[2:4]}{start_date[5:7]}{start_date[-2:]}_ts_info.json', 'w') as output_file:
             json.dump(ts_info, output_file, indent=2)
 
@@ -1,11 +1,16 @@
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import statsmodels.api as sm
 from operator import itemgetter
 from datetime import timedelta
+from copy import deepcopy
+from hashlib import sha1
+from concurrent.futures import ProcessPoolExecutor
 from scipy.optimize import curve_fit
-from matplotlib.dates import num2date, date2num, DateFormatter
+from matplotlib.dates import num2date, date2num, DateFormatter, get_epoch
+from linear_fits import fit_line, fit_sums, fit_candidates, robust_fit_lines
+from batch_fitting import pack, fit_batch
+from result_buffer import init_buffer, append_row, to_dataframe
+from line_tracking import init_tracker, lines_with_point, line_count, new_line, extend_line, drop_first, remove_line
 
 
 #################### FUNCTIONS #####################
@@ -30,52 +35,47 @@ def cal_mae(x,y,popt):
     y_predicted = linear(x, *popt)
     mean_absolute_error = np.mean(np.abs(y - y_predicted)) * 24
     return mean_absolute_error
+def cal_maes(residuals):
+    '''Calculates mean absolute errors (hours) of many fits at once (fits × points).'''
+    return np.mean(np.abs(residuals), axis=1) * 24
 def cal_derivative(dataframe):
     '''
     Calculates 1st derivatives between neighbouring datapoints. 
     Returns dataframe with derivatives, unit: cm⁻³/h
     '''
-    df_derivatives = pd.DataFrame(np.nan, index=dataframe.index[1:], columns=dataframe.columns) 
-    
-    #convert time to days 
-    time_days = date2num(dataframe.index)
-    
-    for i in dataframe.columns: 
-        N = dataframe[i] #concentration
-        time = time_days * 24 #change days to hours
-        dNdt = np.diff(N)/np.diff(time) #derivative
-        df_derivatives.loc[:, i] = dNdt #add calculated derivatives to dataframe
-    return df_derivatives
+    time_hours = date2num(dataframe.index) * 24 #change days to hours
+    dNdt = derivative_values(dataframe.to_numpy(dtype=float),time_hours)
+    return pd.DataFrame(dNdt, index=dataframe.index[1:], columns=dataframe.columns) 
+def derivative_values(values,time_hours):
+    '''Derivatives of all diameter channels at once (time × channel array).'''
+    return np.diff(values,axis=0) / np.diff(time_hours)[:,None]
 def average_filter(dataframe,window):         
     '''Smoothens data in dataframe with average filter and given window.'''
-    smoothed_df = dataframe.copy()
-    for i in dataframe.columns:
-       smoothed_df[i] = smoothed_df[i].rolling(window=window, center=True).mean()
-    smoothed_df.dropna()
-    return smoothed_df 
+    smoothed = smooth_values(dataframe.to_numpy(dtype=float),window)
+    return pd.DataFrame(smoothed, index=dataframe.index, columns=dataframe.columns)
+def smooth_values(values,window):
+    '''
+    Centered moving average of all diameter channels at once (time × channel array).
+    Like pandas rolling mean, windows with missing values and the edges are nan.
+    '''
+    smoothed = np.full(values.shape, np.nan)
+    if len(values) >= window:
+        windows = np.lib.stride_tricks.sliding_window_view(values,window,axis=0)
+        smoothed[window//2:window//2+len(windows)] = windows.mean(axis=-1)
+    return smoothed
 
 #mathematical functions for fitting
 def gaussian(x,a,x0,sigma): 
     return a*np.exp(-(x-x0)**2/(2*sigma**2))
+def gaussian_jacobian(x,params):
+    '''Derivatives of gaussian with respect to a, x0 and sigma (fits × points × params).'''
+    a, x0, sigma = (params.T[:,:,None])
+    exponential = np.exp(-(x-x0)**2/(2*sigma**2))
+    return np.stack([exponential, a*exponential*(x-x0)/sigma**2, a*exponential*(x-x0)**2/sigma**3], axis=-1)
 def logistic(x,L,x0,k): 
     return L / (1 + np.exp(-k*(x-x0))) 
 def linear(x,k,b):
     return k*x + b
-def robust_fit(x,y):
-        '''Robust linear regression using statsmodels with HuberT weighting.'''
-        x_linear = np.linspace(np.min(x), np.max(x),num=len(y))
-        rlm_HuberT = sm.RLM(y, sm.add_constant(x), M=sm.robust.norms.HuberT())
-        rlm_results = rlm_HuberT.fit()
-        
-        #predict data of estimated models
-        y_rlm = rlm_results.predict(sm.add_constant(x_linear))
-        y_params = rlm_results.params
-        
-        #print("Statsmodel robus linear model results: \n",rlm_results.summary())
-        #print("\nparameters: ",rlm_results.params)
-        #print(help(sm.RLM.fit))
-
-        return x_linear, y_rlm, y_params
 
 #################### METHODS #######################
 def find_peak_areas(df_filtered,df_deriv,mpd,derivative_threshold):
@@ -86,148 +86,131 @@ def find_peak_areas(df_filtered,df_deriv,mpd,derivative_threshold):
     mtd = maximum time difference between peaks to be considered the same horizontal peak area
     '''
     #initialize variables
-    df_peak_areas = pd.DataFrame()
+    peak_areas = init_buffer({"start_time": "datetime64[ns]", "end_time": "datetime64[ns]", "diameter": float})
     start_times_list = []
     maxima_list = []
 
-    #define a boolean dataframe where the derivative threshold has been surpassed
-    df_surpassed = df_deriv > derivative_threshold
+    #work with raw arrays (time × channel) and index arithmetic
+    times = df_filtered.index
+    t = times.to_numpy()
+    conc = df_filtered.to_numpy(dtype=float)
+    deriv = df_deriv.to_numpy(dtype=float)
+
+    #define a boolean array where the derivative threshold has been surpassed
+    surpassed = deriv > derivative_threshold
 
     #find start points and shift them one timestamp earlier
-    df_start_points = df_surpassed & (~df_surpassed.shift(1,fill_value=False)) 
-    df_start_points = df_start_points.shift(-1, fill_value=False)
+    #(derivatives start from the 2nd timestamp, so start point k is at timestamp k+1)
+    crossings = surpassed & ~np.vstack([np.zeros((1,surpassed.shape[1]),dtype=bool), surpassed[:-1]])
+    start_points = np.zeros(surpassed.shape, dtype=bool)
+    start_points[:-1] = crossings[1:]
 
     #find local concentration maxima
-    df_left = df_filtered.shift(-1)
-    df_right = df_filtered.shift(1)
-    df_maxima = (df_left < df_filtered) & (df_filtered > df_right)
+    maxima = np.zeros(conc.shape, dtype=bool)
+    maxima[1:-1] = (conc[2:] < conc[1:-1]) & (conc[1:-1] > conc[:-2])
 
-    max_peak_diff = timedelta(hours=mpd) #max time difference between peaks to be considered the same peak
+    max_peak_diff = np.timedelta64(timedelta(hours=mpd)) #max time difference between peaks to be considered the same peak
+    subset_length = np.timedelta64(timedelta(hours=15)) #look for peak areas 15 hours ahead
+    min_concs = np.nanmin(conc, axis=0) #global minimum of each channel
 
     #iterate over diameter channels
-    for diam in df_deriv.columns:
+    for j, diam in enumerate(df_deriv.columns):
+        channel = conc[:,j]
+        channel_maxima = maxima[:,j] #view, merged maxima stay merged for later start times
         
         #define start times and end time
-        df_start_points_only = df_start_points[diam][df_start_points[diam].values]
-        start_times = df_start_points_only.index
-        end_time = None
+        start_i = np.flatnonzero(start_points[:,j]) + 1
+        end_i = None
         
         #save for use in channel plotting
-        start_concs = [df_filtered.loc[start_time,diam] for start_time in start_times]
-        start_times_list.append((diam,start_times,start_concs)) 
+        start_times_list.append((diam,times[start_i],list(channel[start_i]))) 
         
         #iterate over start times
-        for start_time in start_times:
-            try:
-                if start_time < end_time:
-                    continue
-            except TypeError:
-                pass
+        for s_i in start_i:
+            if end_i is not None and s_i < end_i:
+                continue
             
-            #find end time after local maximum concentration 
-            try:
-                subset_end = start_time + timedelta(hours=15) #15 hours ahead
-            except IndexError:
-                subset_end = df_filtered.index[-1]  
-                
-            df_subset = df_filtered.loc[start_time:subset_end,diam]
-            df_subset_maxima = df_maxima.loc[start_time:subset_end,diam].copy()
+            #subset from start time to 15 hours ahead (indices s_i...e_i-1)
+            e_i = np.searchsorted(t, t[s_i] + subset_length, side='right')
+            subset_maxima = channel_maxima[s_i:e_i].copy()
 
             #check if channel has any peaks
-            if not df_subset_maxima.any():
+            if not subset_maxima.any():
                 continue
             
-            #make df with maxima only
-            df_subset_only_maxima = df_subset_maxima[df_subset_maxima.values].copy()
-            df_all_maxima = df_subset_only_maxima.copy()
+            #indices of maxima only
+            all_maxima_i = np.flatnonzero(subset_maxima) + s_i
 
             #check if peaks are nearby and choose higher one
-            for i in range(len(df_subset_only_maxima)):
-                try:
-                    max_time1 = df_subset_only_maxima.index[i]
-                    max_time2 = df_subset_only_maxima.index[i+1]
-                    max_conc1 = df_filtered.loc[max_time1,diam]
-                    max_conc2 = df_filtered.loc[max_time2,diam]
-                    
-                    diff_mins = max_time2-max_time1
-                    
-                    if diff_mins <= max_peak_diff and max_conc1 > max_conc2:
-                        df_maxima.loc[max_time2,diam] = False
-                        df_subset_maxima.loc[max_time2] = False
-                    elif diff_mins <= max_peak_diff and max_conc1 < max_conc2:
-                        df_maxima.loc[max_time1,diam] = False
-                        df_subset_maxima.loc[max_time1] = False
-                except IndexError:
-                    break
-            
-            #update subset_only_maxima
-            df_subset_only_maxima = df_subset_maxima[df_subset_maxima.values].copy()
+            for max_i1, max_i2 in zip(all_maxima_i[:-1],all_maxima_i[1:]):
+                if t[max_i2] - t[max_i1] <= max_peak_diff:
+                    if channel[max_i1] > channel[max_i2]:
+                        channel_maxima[max_i2] = False
+                        subset_maxima[max_i2-s_i] = False
+                    elif channel[max_i1] < channel[max_i2]:
+                        channel_maxima[max_i1] = False
+                        subset_maxima[max_i1-s_i] = False
 
             #save for use in channel plotting
-            maxima_times = df_subset_only_maxima.index
-            maximum_concs = [df_filtered.loc[max_time,diam] for max_time in maxima_times]  
-            maxima_list.append((diam,maxima_times,maximum_concs)) 
+            maxima_i = np.flatnonzero(subset_maxima) + s_i
+            maxima_list.append((diam,times[maxima_i],list(channel[maxima_i]))) 
 
             #choose closest maximum after start time
-            for i in range(len(df_subset_maxima.values)):
-                if df_subset_maxima.index[i] > start_time and df_subset_maxima.values[i] == True:
-                    closest_maximum = df_subset.values[i]
-                    break
-            else: #if no maxima after start time skip this start time
+            maxima_after_start = np.flatnonzero(subset_maxima[1:])
+            if len(maxima_after_start) == 0: #if no maxima after start time skip this channel
                 break
+            closest_maximum = channel[s_i + 1 + maxima_after_start[0]]
             
             #define concentration threshold for ending point
-            min_conc = np.nanmin(df_filtered[diam].values) #global minimum
-            end_conc = (closest_maximum + min_conc) * 0.5 #(N_max + N_min)/2 
+            end_conc = (closest_maximum + min_concs[j]) * 0.5 #(N_max + N_min)/2 
 
             #estimate time for maximum concentration
-            max_conc_time = df_subset.index[df_subset == closest_maximum].tolist()[0] #rough estimate of maximum concentration time 
-            max_conc_time_i = df_filtered.index.get_loc(max_conc_time) #index of max_conc_time
+            max_i = s_i + np.flatnonzero(channel[s_i:e_i] == closest_maximum)[0] #rough estimate of maximum concentration time
             
             #choose next start time after closest local maximum to the maximum
-            if any(df_all_maxima.index < max_conc_time):
-                closest_local_max = df_all_maxima.index[df_all_maxima.index < max_conc_time].max()  
-                start_time = start_times[start_times > closest_local_max].min()
-
-            #define subset from maximum concentration time to end
-            df_subset_maxcon = df_filtered.loc[max_conc_time:subset_end,diam] 
+            area_start_i = s_i
+            if np.any(all_maxima_i < max_i):
+                closest_local_max_i = all_maxima_i[all_maxima_i < max_i].max()
+                later_start_i = start_i[start_i > closest_local_max_i]
+                area_start_i = later_start_i.min() if len(later_start_i) else None
             
             #iterate over concentrations after maximum to find ending time
-            for i, (time,conc) in enumerate(df_subset_maxcon.items()):
+            for i in range(max_i, e_i):
                 #check for another maximum along the way
-                if i != 0 and df_subset_maxima.loc[time]:
-                    timestep_before_next_peak = df_subset_maxcon.index[i-1]
-                    end_conc = min(df_subset_maxcon.loc[max_conc_time:timestep_before_next_peak]) #end point after peak
-                    end_time = df_subset_maxcon.index[df_subset_maxcon.values == end_conc][0] #end time found!
+                if i != max_i and subset_maxima[i-s_i]:
+                    end_conc = channel[max_i:i].min() #end point after peak
+                    end_i = max_i + np.flatnonzero(channel[max_i:e_i] == end_conc)[0] #end time found!
                     break
  
                 #check if concentration drops under the threshold
-                if conc < end_conc:
-                    end_time = time
+                if channel[i] < end_conc:
+                    end_i = i
                     break
             else:
                 #in case we reach the end of the subset without falling under the end conc value
-                end_time = df_subset_maxcon.index[-1]
+                end_i = e_i - 1
             
             # #attempt to filter peaks that are not at least 1000 cm⁻³ higher than their min value
-            # min_conc = min(dataframe.loc[start_time:max_conc_time,diam])
+            # min_conc = min(channel[area_start_i:max_i+1])
             # if closest_maximum - min_conc < mcd:
             #     continue
 
             #save peak areas longer than 3 datapoints
-            subset = df_filtered[diam].loc[start_time:end_time]
-            if len(subset.values) > 3:
-                #df_peak_areas.loc[subset.index,diam] = subset #fill dataframe
-                new_row = pd.DataFrame({"start_time": [start_time], "end_time": [end_time], "diameter": [diam]})
-                df_peak_areas = pd.concat([df_peak_areas,new_row],ignore_index=True)
-                    
+            if area_start_i is not None and end_i + 1 - area_start_i > 3:
+                append_row(peak_areas, start_time=t[area_start_i], end_time=t[end_i], diameter=diam)
+    
+    df_peak_areas = to_dataframe(peak_areas)
     df_peak_areas.to_csv('./find_peak_areas.csv', sep=',', header=True, index=True, na_rep='nan')
     return df_peak_areas, derivative_threshold, start_times_list, maxima_list
 def maximum_concentration(df,df_peak_areas): 
-    '''Calculates maximum concentration in peak areas with gaussian fit.'''
+    '''
+    Calculates maximum concentration in peak areas with gaussian fit.
+    All peak areas are fitted at once, the fit status of every area is returned
+    (1 = converged, 0 = did not converge, -1 = could not be fitted).
+    '''
     
     #create lists for results
-    df_mc = pd.DataFrame()
+    mc = init_buffer({"timestamp": "datetime64[ns]", "peak_diameter": float, "max_concentration": float},capacity=len(df_peak_areas))
     fitting_params = []
     area_edges = []
 
@@ -237,103 +220,149 @@ def maximum_concentration(df,df_peak_areas):
     end_times = area_values[:,1]
     area_diams = area_values[:,2]
     
-    #gaussian fit to every horizontal area of growth
-    for i in range(len(start_times)):
-        start_time = start_times[i]
-        end_time = end_times[i]
-        diam = area_diams[i]
-        
-        #find values from the dataframe
-        subset = df.loc[start_time:end_time,diam]
-        x = date2num(subset.index) #time in days
-        y = subset.values #concentration
+    #find values of every peak area from the dataframe
+    time_days = date2num(df.index) #time in days
+    values = df.to_numpy(dtype=float) #concentration
+    start_i = df.index.searchsorted(pd.DatetimeIndex(start_times), side='left')
+    end_i = df.index.searchsorted(pd.DatetimeIndex(end_times), side='right')
+    diam_i = df.columns.get_indexer(area_diams)
+    xs = [time_days[start:end] for start, end in zip(start_i,end_i)]
+    ys = [values[start:end,col] for start, end, col in zip(start_i,end_i,diam_i)]
+    x, y, mask = pack(xs,ys)
+    lengths = mask.sum(axis=1)
+
+    #rescaling for more stable fitting
+    x_min = x[:,0]
+    y_min = np.min(y, axis=1, where=mask, initial=np.inf)
+    x = np.where(mask, x - x_min[:,None], 0)
+    y = np.where(mask, y - y_min[:,None], 0)
     
-        #rescaling for more stable fitting
-        x_min, y_min = min(x), min(y)
-        x = x - x_min
-        y = y - y_min
-        
-        #initial guess for parameters
-        mu=np.mean(x)
-        sigma = np.std(x)
-        a = max(y)
+    #initial guess for parameters
+    mu = np.sum(x, axis=1) / lengths
+    sigma = np.sqrt(np.sum(np.where(mask, (x - mu[:,None])**2, 0), axis=1) / lengths)
+    a = np.max(y, axis=1, where=mask, initial=-np.inf)
 
-        try: #gaussian fit
-            popt,pcov = curve_fit(gaussian,x,y,p0=[a,mu,sigma],bounds=((0,0,-np.inf),(max(y),np.inf,np.inf)))
+    #gaussian fit to every horizontal area of growth
+    p0 = np.column_stack([a,mu,sigma])
+    lower = np.zeros(p0.shape) + [0,0,-np.inf]
+    upper = np.column_stack([a,np.full(len(a),np.inf),np.full(len(a),np.inf)])
+    popts, status = fit_batch(gaussian,gaussian_jacobian,x,y,mask,p0,lower,upper)
+
+    for i in np.flatnonzero(status == 1):
+        popt = popts[i]
+        x_i = x[i,:lengths[i]]
             
-            #checking that the peak is within time range and not at the edges
-            if ((popt[1]<=x.min()) | (popt[1]>=x.max()) | (popt[1]<x[1]) | (popt[1]>x[-2])): 
-                pass
-            else:
-                #save results to df
-                new_row = pd.DataFrame({"timestamp": [num2date(popt[1]+x_min).replace(tzinfo=None)], \
-                                        "peak_diameter": [diam], "max_concentration": [popt[0]+y_min]})
-                df_mc = pd.concat([df_mc,new_row],ignore_index=True)
-
-                #save gaussian fit parameters and peak area edges for channel plotting 
-                fitting_params.append([diam,y_min,popt[0],popt[1]+x_min,popt[2]]) #[diam,ymin for scale,a,mu,sigma]
-                area_edges.append([diam,start_time,end_time]) #[diameter,start time, end time]
-                                           
-        except:
-            pass
-            #print("Diverges. Skipping.")
-
-    return df_mc, fitting_params, area_edges
-def appearance_time(df,mc_params,mc_area_edges):
-    '''Calculates appearance times in peak areas with logistic fit.'''
+        #checking that the peak is within time range and not at the edges
+        if ((popt[1]<=x_i.min()) | (popt[1]>=x_i.max()) | (popt[1]<x_i[1]) | (popt[1]>x_i[-2])): 
+            continue
+
+        #save results
+        append_row(mc, timestamp=num2date(popt[1]+x_min[i]).replace(tzinfo=None),
+                   peak_diameter=area_diams[i], max_concentration=popt[0]+y_min[i])
+
+        #save gaussian fit parameters and peak area edges for channel plotting 
+        fitting_params.append([area_diams[i],y_min[i],popt[0],popt[1]+x_min[i],popt[2]]) #[diam,ymin for scale,a,mu,sigma]
+        area_edges.append([area_diams[i],start_times[i],end_times[i]]) #[diameter,start time, end time]
+
+    return to_dataframe(mc), fitting_params, area_edges, status
+def fit_logistic(x,y,L,k):
+    '''
+    Logistic fit to rising edge of peak area with initial growth rate k.
+    Returns fitted parameters or None if the fit fails or mid point is outside of time range.
+    '''
+    x0 = np.nanmean(x) #midpoint x value
+    try:
+        popt,pcov = curve_fit(logistic,x,y,p0=[L,x0,k],bounds=((L*0.999,0,-np.inf),(L,np.inf,np.inf)))
+    except RuntimeError:
+        return None
+    if ((popt[1]>=x.max()) | (popt[1]<=x.min()) | (popt[1]<x[1])): #checking that the mid point is within time range   
+        return None
+    return popt
+def fit_logistic_areas(areas):
+    '''
+    Logistic fits to a group of peak areas.
+    
+    areas = list of (index, x, y, L), x and y rescaled and sliced
+    Returns list of (index, popt), popt is None for failed or rejected fits.
+    '''
+    return [(i, fit_logistic(x,y,L,1.0)) for i, x, y, L in areas]
+def appearance_time(df,mc_params,mc_area_edges,workers=None):
+    '''
+    Calculates appearance times in peak areas with logistic fit.
+    Groups of peak areas are fitted in parallel.
+    
+    workers = number of worker processes (default: 1 = no pool)
+    '''
     
     #create lists for results
-    df_at = pd.DataFrame()
+    at = init_buffer({"timestamp": "datetime64[ns]", "diameter": float, "mid_concentration": float},capacity=len(mc_area_edges))
     fitting_params = []
     area_edges = []
+    if not mc_area_edges:
+        return to_dataframe(at), fitting_params, area_edges
     
-    #logistic fit to every horizontal area of growth
-    for mc_edge, mc_param in zip(mc_area_edges,mc_params):
-        diam, start_time, end_time = mc_edge
-        diam, _, a, mu, __ = mc_param
-        
-        #find values from the dataframe
-        subset = df.loc[start_time:end_time,diam]
-        x = date2num(subset.index) #time in days
-        y = subset.values #concentration
+    diams = [mc_edge[0] for mc_edge in mc_area_edges]
+    start_times = pd.DatetimeIndex([mc_edge[1] for mc_edge in mc_area_edges])
+    end_times = pd.DatetimeIndex([mc_edge[2] for mc_edge in mc_area_edges])
+    mus = np.array([mc_param[3] for mc_param in mc_params]) #maximum concentration times (days)
+
+    #find values of every peak area from the dataframe
+    time_days = date2num(df.index) #time in days
+    values = df.to_numpy(dtype=float) #concentration
+    start_i = df.index.searchsorted(start_times, side='left')
+    end_i = df.index.searchsorted(end_times, side='right')
+    diam_i = df.columns.get_indexer(diams)
+    
+    areas, x_mins, y_mins = [], [], []
+    for i, mc_param in enumerate(mc_params):
+        x = time_days[start_i[i]:end_i[i]]
+        y = values[start_i[i]:end_i[i],diam_i[i]]
     
         #rescaling for more stable fitting
-        x_min, y_min = min(x), min(y)
+        x_min, y_min = x.min(), y.min()
         x = x - x_min
         y = y - y_min
-        mu = mu - x_min
+        x_mins.append(x_min)
+        y_mins.append(y_min)
         
         #limit x and y to values between start time of peak area and maximum concentration time in peak area
-        max_conc_time = mu
-        max_conc_index = closest(x, max_conc_time)
-        x_sliced, y_sliced = x[:max_conc_index+1], y[:max_conc_index+1]
-
-        #logistic fit for more than 2 datapoints
-        if len(y_sliced) > 2: 
-            #initial guess for parameters
-            L = a #maximum value of gaussian fit
-            x0 = np.nanmean(x_sliced) #midpoint x value
-            k = 1.0 #growth rate
-
-            try: #logistic fit
-                popt,pcov = curve_fit(logistic,x_sliced,y_sliced,p0=[L,x0,k],bounds=((L*0.999,0,-np.inf),(L,np.inf,np.inf)))
-                if ((popt[1]>=x_sliced.max()) | (popt[1]<=x_sliced.min()) | (popt[1]<x_sliced[1])): #checking that the mid point is within time range   
-                    pass
-                else:
-                    #save results to df
-                    new_row = pd.DataFrame({"timestamp": [num2date(popt[1]+x_min).replace(tzinfo=None)], \
-                                            "diameter": [diam], "mid_concentration": [popt[0]/2+y_min]})
-                    df_at = pd.concat([df_at,new_row],ignore_index=True) #appearance time concentration (~50% maximum concentration), L/2
-
-                    #save logistic fit parameters and peak area edges for channel plotting 
-                    fitting_params.append([diam, y_min, popt[0], popt[1]+x_min, popt[2]]) #[diam,y min for scale,L,x0,k]
-                    area_edges.append([diam,
-                        num2date(x_sliced[0] + x_min).replace(tzinfo=None),
-                        num2date(x_sliced[-1] + x_min).replace(tzinfo=None)])
-            except RuntimeError:
-                continue
+        max_conc_time = mus[i] - x_min
+        max_conc_index = min(np.searchsorted(x, max_conc_time), len(x)-1)
+        if max_conc_index > 0 and max_conc_time - x[max_conc_index-1] <= x[max_conc_index] - max_conc_time:
+            max_conc_index -= 1 #closest datapoint, earlier one in ties
+        areas.append((x[:max_conc_index+1], y[:max_conc_index+1], mc_param[2])) #L = maximum value of gaussian fit
+
+    #logistic fit for more than 2 datapoints, areas are split evenly between workers
+    workers = workers or 1
+    tasks = [(i, *area) for i, area in enumerate(areas) if len(area[1]) > 2]
+    groups = [tasks[k::workers] for k in range(min(workers,len(tasks)))]
+
+    if workers == 1 or len(groups) < 2:
+        results = list(map(fit_logistic_areas, groups))
+    else:
+        with ProcessPoolExecutor(max_workers=len(groups)) as executor:
+            results = list(executor.map(fit_logistic_areas, groups))
+    popts = dict(result for group_results in results for result in group_results)
+
+    #collect results in the original order of areas
+    for i, diam in enumerate(diams):
+        popt = popts.get(i)
+        if popt is None:
+            continue
+        x_sliced = areas[i][0]
+        x_min, y_min = x_mins[i], y_mins[i]
+
+        #save results
+        append_row(at, timestamp=num2date(popt[1]+x_min).replace(tzinfo=None),
+                   diameter=diam, mid_concentration=popt[0]/2+y_min) #appearance time concentration (~50% maximum concentration), L/2
+
+        #save logistic fit parameters and peak area edges for channel plotting 
+        fitting_params.append([diam, y_min, popt[0], popt[1]+x_min, popt[2]]) #[diam,y min for scale,L,x0,k]
+        area_edges.append([diam,
+            num2date(x_sliced[0] + x_min).replace(tzinfo=None),
+            num2date(x_sliced[-1] + x_min).replace(tzinfo=None)])
                           
-    return df_at, fitting_params, area_edges
+    return to_dataframe(at), fitting_params, area_edges
 def disappearance_time(df,df_at,mc_area_edges):
     '''Calculates disappearance times in peak areas
     
@@ -341,8 +370,8 @@ def disappearance_time(df,df_at,mc_area_edges):
     - fitting reversed logistic?
     '''
     
-    #create lists for results
-    df_dt = pd.DataFrame()
+    #create buffer for results
+    dt = init_buffer({"timestamp": "datetime64[ns]", "diameter": float, "concentration": float},capacity=len(df_at))
 
     #find matching disappearance times for appearance times
     for at_point in df_at.values:
@@ -372,15 +401,35 @@ def disappearance_time(df,df_at,mc_area_edges):
             
             #disappearance found!
             if conc < x0_conc:
-                #save results to df
-                new_row = pd.DataFrame({"timestamp": [ts], \
-                                        "diameter": [x0_diam], "concentration": [conc]})
-                df_dt = pd.concat([df_dt,new_row],ignore_index=True)
+                #save results
+                append_row(dt, timestamp=ts, diameter=x0_diam, concentration=conc)
                 break
                       
-    return df_dt
-def init_methods(df,mpd,mdc,derivative_threshold):
-    '''Initialize all functions.'''
+    return to_dataframe(dt)
+methods_cache = {} #results of init_methods
+def frame_key(df):
+    '''Content hash of a dataframe (values, times and diameters).'''
+    digest = sha1()
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    digest.update(pd.util.hash_array(np.asarray(df.columns)).tobytes())
+    return digest.hexdigest()
+def init_methods(df,mpd,mdc,derivative_threshold,workers=None):
+    '''
+    Initialize all functions.
+    Results are cached by the data, parameters and matplotlib epoch (fitting
+    parameters are in days from the epoch), so later calls with the same
+    input reuse them. Copies of the cached results are returned.
+
+    workers = number of processes for appearance time fits (default: 1 = no pool)
+    '''
+    key = (frame_key(df), mpd, mdc, derivative_threshold, get_epoch())
+    if key not in methods_cache:
+        if len(methods_cache) >= 8: #drop oldest results
+            del methods_cache[next(iter(methods_cache))]
+        methods_cache[key] = run_methods(df,mpd,mdc,derivative_threshold,workers)
+    return deepcopy(methods_cache[key])
+def run_methods(df,mpd,mdc,derivative_threshold,workers=None):
+    '''Runs all methods from smoothing to appearance times.'''
 
     #crop dataframe by allowed mdc (maximum diameter channel)
     df = df[df.columns[df.columns <= mdc]]
@@ -392,8 +441,10 @@ def init_methods(df,mpd,mdc,derivative_threshold):
     df_peak_areas, derivative_threshold, start_times_list, maxima_list = find_peak_areas(df_filtered,df_deriv,mpd,derivative_threshold)
     
     #methods
-    df_mc, mc_params, mc_area_edges = maximum_concentration(df_interpolated,df_peak_areas)
-    df_at, at_params, at_area_edges = appearance_time(df_interpolated,mc_params,mc_area_edges)
+    df_mc, mc_params, mc_area_edges, mc_status = maximum_concentration(df_interpolated,df_peak_areas)
+    if np.any(mc_status < 1):
+        print(f"Gaussian fit did not converge in {np.sum(mc_status < 1)}/{len(mc_status)} peak areas, skipping them.")
+    df_at, at_params, at_area_edges = appearance_time(df_interpolated,mc_params,mc_area_edges,workers)
     df_dt = disappearance_time(df_interpolated,df_at,mc_area_edges)
 
     #find points that are poorly defined
@@ -422,14 +473,6 @@ def init_methods(df,mpd,mdc,derivative_threshold):
     return df_mc, df_at, df_dt, incomplete_mc_xyz, incomplete_at_xyz, mc_area_edges, at_area_edges, mc_params, at_params, derivative_threshold, start_times_list, maxima_list
 
 ################## GROWTH RATES ####################
-def points_in_existing_line(unfinished_lines, point, nearby_point=None):
-    ''' Calculates in how many line a datapoint is.'''
-    if nearby_point is None:
-        score = sum([1 for line in unfinished_lines if point in line])
-    else:
-        score = sum([1 for line in unfinished_lines if point in line])
-        score += sum([1 for line in unfinished_lines if nearby_point in line])
-    return score
 def extract_data(line,exclude_start=0,exclude_end=0):
     '''Extracts wanted data points from line.'''
     return ([point[1] for point in line[exclude_start:len(line)-exclude_end]],  #x values
@@ -453,7 +496,7 @@ def find_growth(df,times,diams,mgsc,a,gret):
     data_sorted = np.array(sorted(zip(times, diams), key=itemgetter(1,0))) #[[time1,diam1],[time2,diam2]...]
 
     #init
-    unfinished_lines = []
+    unfinished_lines = init_tracker(lambda point: (point[1],point[0])) #x=diams,y=times
     finalized_lines = []
     results_dict = {}
     mtd = 2.5 #h, initial maximum time difference
@@ -481,39 +524,39 @@ def find_growth(df,times,diams,mgsc,a,gret):
                 continue
             
             #closest datapoint next in list
-            if points_in_existing_line(unfinished_lines,datapoint) == 0:
+            num_of_lines = line_count(unfinished_lines,datapoint)
+            if num_of_lines == 0:
                 nearby_datapoint = tuple(min(closest_channel_points, key=lambda point: abs(point[0] - time0)))
                 time1, diam1 = nearby_datapoint
-            elif points_in_existing_line(unfinished_lines,datapoint) > 1: #datapoint in many lines (convergence)
-                converging_lines = [line for line in unfinished_lines if datapoint in line]
+            elif num_of_lines > 1: #datapoint in many lines (convergence)
+                converging_lines = lines_with_point(unfinished_lines,datapoint)
                 nearby_datapoint = tuple(min(closest_channel_points, key=lambda point: abs(point[0] - time0)))
                 
                 #continue the line that best fits the next datapoint
                 #minimize MAE
                 maes = []
-                for line in converging_lines:
-                    line_with_new_point = line + [nearby_datapoint]
-                    x, y = extract_data(line_with_new_point) #x=diams,y=times
-                    popt, pcov = curve_fit(linear, x, y)
-                    mae = cal_mae(x,y,popt)
+                for line_id in converging_lines:
+                    x, y = extract_data(unfinished_lines['lines'][line_id]) #x=diams,y=times
+                    *_, residuals = fit_candidates(x,y,[nearby_datapoint[1]],[nearby_datapoint[0]],
+                                                   sums=unfinished_lines['sums'][line_id])
+                    mae = cal_maes(residuals)[0]
                     maes.append(mae)
 
                 min_mae_i = maes.index(min(maes))
-                line_before = converging_lines[min_mae_i]
-                iii = unfinished_lines.index(line_before)
+                iii = converging_lines[min_mae_i]
+                line_before = unfinished_lines['lines'][iii]
             else:
                 #minimize MAE when choosing the new point
-                iii, line_before = [(i,line) for i,line in enumerate(unfinished_lines) if datapoint in line][0]
+                iii = lines_with_point(unfinished_lines,datapoint)[0]
+                line_before = unfinished_lines['lines'][iii]
 
-                maes = []
-                for point in closest_channel_points:
-                    line_with_new_point = line_before + [point]
-                    x, y = extract_data(line_with_new_point) #x=diams,y=times
-                    popt, pcov = curve_fit(linear, x, y)
-                    mae = cal_mae(x,y,popt)
-                    maes.append(mae)
+                #fit line with every candidate point at once
+                x, y = extract_data(line_before) #x=diams,y=times
+                x_new, y_new = extract_data(closest_channel_points)
+                *_, residuals = fit_candidates(x,y,x_new,y_new,sums=unfinished_lines['sums'][iii])
+                maes = cal_maes(residuals)
 
-                min_mae_i = maes.index(min(maes))
+                min_mae_i = int(np.argmin(maes))
                 nearby_datapoint = tuple(closest_channel_points[min_mae_i])
                 
                 time1, diam1 = nearby_datapoint
@@ -522,8 +565,7 @@ def find_growth(df,times,diams,mgsc,a,gret):
                 #more strict diameter range when finding the 3rd/4th point
                 if len(line_before) == 2 or len(line_before) == 3:
                     #calculate growth rate
-                    x, y = extract_data(line_before) #x=diams,y=times
-                    popt, pcov = curve_fit(linear, x, y)
+                    popt = fit_sums(unfinished_lines['sums'][iii])
                     GR = 1/(popt[0]) #nm/days
 
                     b = 0 #1 hour in days
@@ -536,26 +578,24 @@ def find_growth(df,times,diams,mgsc,a,gret):
                         
                     #if nearby datapoint is not in the time limits
                     if time1 <= low_time_limit or time1 >= high_time_limit:
-                        unfinished_lines[iii] = line_before[1:] + [nearby_datapoint]
+                        drop_first(unfinished_lines,iii)
+                        extend_line(unfinished_lines,iii,nearby_datapoint)
                         break
             
             ### add new point to a line ###
-            if points_in_existing_line(unfinished_lines,datapoint) == 0:
+            if num_of_lines == 0:
                 if diam0 > mgsc or diam1 > mgsc:
                     break
-                unfinished_lines.append([datapoint,nearby_datapoint])
+                new_line(unfinished_lines,[datapoint,nearby_datapoint])
                 break
                 
-            elif points_in_existing_line(unfinished_lines,datapoint) > 0:
-                unfinished_lines[iii] = line_before + [nearby_datapoint]
-            
-            #make sure datapoints in every line are sorted by diameter
-            unfinished_lines = [list(set(line)) for line in unfinished_lines]
-            unfinished_lines = [sorted(sublist, key=lambda x: x[1]) for sublist in unfinished_lines] 
+            elif num_of_lines > 0:
+                #datapoint is the last point of its lines, so the line stays sorted by diameter
+                extend_line(unfinished_lines,iii,nearby_datapoint)
 
 
             ### make a linear fit to check mae for line with new datapoint ###
-            iii, line_after = [(i,line) for i,line in enumerate(unfinished_lines) if datapoint in line and nearby_datapoint in line][0]
+            line_after = unfinished_lines['lines'][iii]
             
             #define variables for linear fit
             x, y = extract_data(line_after) #x=diams,y=times
@@ -568,21 +608,21 @@ def find_growth(df,times,diams,mgsc,a,gret):
 
 
             if len(line_after) <= min_line_length:
-                popt, pcov = curve_fit(linear, x, y)
+                popt = fit_sums(unfinished_lines['sums'][iii])
                 mae = cal_mae(x,y,popt)
                 
                 if mae > mae_threshold:
-                    unfinished_lines[iii] = line_after[1:] #remove first point  
+                    drop_first(unfinished_lines,iii) #remove first point  
                 break
             else:
                 #calculate growth rates of first 4 and last 4 points
-                popt_first_4, pcov = curve_fit(linear, x_first_4, y_first_4)
+                popt_first_4 = fit_line(x_first_4, y_first_4)
                 GR_first_4 = 1/(popt_first_4[0]*24)
-                popt_last_4, pcov = curve_fit(linear, x_last_4, y_last_4)
+                popt_last_4 = fit_line(x_last_4, y_last_4)
                 GR_last_4 = 1/(popt_last_4[0]*24)
                 
                 #fit to full line
-                popt, pcov = curve_fit(linear, x, y)
+                popt = fit_sums(unfinished_lines['sums'][iii])
                 mae = cal_mae(x,y,popt)
                 
                 #if growth rate is under 1nm/h error is +-0.5nm/h, otherwise gret
@@ -595,34 +635,35 @@ def find_growth(df,times,diams,mgsc,a,gret):
                 
 
                 if mae > mae_threshold:
-                    unfinished_lines = [line for line in unfinished_lines if line != line_after]
+                    remove_line(unfinished_lines,iii)
                     finalized_lines.append(line_after[:-1])
                     
                     if diam0 > mgsc or diam1 > mgsc:
                         break
-                    unfinished_lines.append([datapoint,nearby_datapoint]) #new line starts with end of previous one
+                    new_line(unfinished_lines,[datapoint,nearby_datapoint]) #new line starts with end of previous one
 
                 elif len(line_after) >= 4 and gr_error > gr_error_threshold:
                     #remove last point if threshold is exceeded
-                    unfinished_lines = [line for line in unfinished_lines if line != line_after]
+                    remove_line(unfinished_lines,iii)
                     finalized_lines.append(line_after[:-1])
  
                     if diam0 > mgsc or diam1 > mgsc:
                         break
-                    unfinished_lines.append([datapoint,nearby_datapoint])
+                    new_line(unfinished_lines,[datapoint,nearby_datapoint])
                 
                 break
 
     
     #add rest of the lines to finalized lines and by diameter
-    unfinished_lines = [line for line in unfinished_lines if len(line) >= min_line_length]
+    unfinished_lines = [line for line in unfinished_lines['lines'].values() if len(line) >= min_line_length]
     finalized_lines.extend(unfinished_lines)
     finalized_lines = [sorted(line, key=lambda x: x[1]) for line in finalized_lines] 
     
-    #robust fit, calculate maes and growth rates
-    for i, finalized_line in enumerate(finalized_lines):
-        x, y = extract_data(finalized_line) #x=diams,y=times
-        x_fit, y_fit, params = robust_fit(x,y)
+    #robust fit of all lines at once, calculate maes and growth rates
+    lines_xy = [extract_data(finalized_line) for finalized_line in finalized_lines] #x=diams,y=times
+    robust_fits = robust_fit_lines([x for x,y in lines_xy],[y for x,y in lines_xy])
+    
+    for i, (finalized_line, (x, y), (x_fit, y_fit, params)) in enumerate(zip(finalized_lines,lines_xy,robust_fits)):
         mae = cal_mae(x,y,[params[1],params[0]]) #h
         GR = 1/(params[1]*24) #nm/h
         
@@ -644,18 +685,20 @@ def init_find(df,df_mc,df_AT,mgsc,a,gret):
     return mc_results, at_results 
     
 #################### PLOTTING ######################
-def plot_channel(df,diameter_list_i,mpd,mdc,threshold_deriv,show_start_times_and_maxima):
+def plot_channel(df,diameter_list_i,mpd,mdc,threshold_deriv,show_start_times_and_maxima,df_methods=None):
     '''
     Plots chosen diameter channels with various useful information.
     
     mpd = maximum peak difference
     mdc = maximum diameter channel 
+    df_methods = dataframe that the methods were run with (default df), 
+                 reuses results of init_methods
     '''   
     
     '''1 assemble all datasets'''
     df_mc, df_at, df_dt, incomplete_mc_xyz, incomplete_mc_xyz, peak_area_edges_gaussian, peak_area_edges_logistic, \
         fitting_parameters_gaus, fitting_parameters_logi,  \
-        threshold_deriv, start_times_list, maxima_list = init_methods(df,mpd,mdc,threshold_deriv)
+        threshold_deriv, start_times_list, maxima_list = init_methods(df if df_methods is None else df_methods,mpd,mdc,threshold_deriv)
 
     '''2 define lists and their shapes'''
     xy_maxcon =  []             #[(max con diameter, max con time (UTC), max con), ...]
@@ -689,6 +732,7 @@ def plot_channel(df,diameter_list_i,mpd,mdc,threshold_deriv,show_start_times_and
 
 
     '''4 plotting'''
+    import matplotlib.pyplot as plt #only loaded when channels are plotted
     fig, ax1 = plt.subplots(len(diameter_list),2,figsize=(9, 4.7), dpi=300)
     fig.subplots_adjust(wspace=0.38, hspace=0.29) #adjust spaces between subplots
     ax1 = np.atleast_2d(ax1) #to avoid problems with plotting only one channel
@@ -1,9 +1,9 @@
 import numpy as np
-import statsmodels.api as sm
 from datetime import timedelta
-from scipy.optimize import curve_fit
 from operator import itemgetter
 from matplotlib.dates import date2num
+from linear_fits import fit_line, fit_sums, fit_candidates, robust_fit_lines
+from line_tracking import init_tracker, lines_with_point, line_count, new_line, extend_line, drop_first, remove_line
 
 ################# USEFUL FUNCTIONS ##################
 def closest(list, number):
@@ -21,36 +21,24 @@ def cal_mape(x,y,popt):
     absolute_error = np.abs(y - y_predicted)
     mape = np.mean(absolute_error / y) * 100
     return mape
+def cal_mapes(y_all,residuals):
+    '''Calculates mean absolute percentage errors (%) of many fits at once (fits × points).'''
+    return np.mean(np.abs(residuals) / y_all, axis=1) * 100
 def linear(x,k,b):
     return k*x + b
-def robust_fit(x,y):
-        '''Robust linear regression using statsmodels with HuberT weighting.'''
-        x_linear = np.linspace(np.min(x), np.max(x),num=len(y))
-        rlm_HuberT = sm.RLM(y, sm.add_constant(x), M=sm.robust.norms.HuberT())
-        rlm_results = rlm_HuberT.fit()
-        
-        #predict data of estimated models
-        y_rlm = rlm_results.predict(sm.add_constant(x_linear))
-        y_params = rlm_results.params
-        
-        #for printing fitting results
-        # print("Statsmodel robus linear model results: \n",rlm_results.summary())
-        # print("\nparameters: ",rlm_results.params)
-        # print(help(sm.RLM.fit))
-
-        return x_linear, y_rlm, y_params
-def points_in_existing_line(unfinished_lines, point, nearby_point=None):
-    ''' Calculates in how many line a datapoint is.'''
-    if nearby_point is None:
-        score = sum([1 for line in unfinished_lines if point in line])
-    else:
-        score = sum([1 for line in unfinished_lines if point in line])
-        score += sum([1 for line in unfinished_lines if nearby_point in line])
-    return score
 def extract_data(line,exclude_start=0,exclude_end=0):
     '''Extracts wanted data points from line.'''
     return (date2num([point[0] for point in line[exclude_start:len(line)-exclude_end]]),  #x values
             [point[1] for point in line[exclude_start:len(line)-exclude_end]])  #y values
+def points_in_timestamp(data_sorted,time_axis,timestamp):
+    '''
+    Returns datapoints in given timestamp.
+    Binary search on the numeric time axis of time sorted datapoints.
+    '''
+    t = date2num(timestamp)
+    i_start = np.searchsorted(time_axis, t, side='left')
+    i_end = np.searchsorted(time_axis, t, side='right')
+    return data_sorted[i_start:i_end]
 
 #####################################################
 def find_growth(df_peaks,a,gret):
@@ -68,9 +56,10 @@ def find_growth(df_peaks,a,gret):
     
     #combine to the same list and sort data by diameter
     data_sorted = np.array(sorted(zip(times, diams), key=itemgetter(0,1))) #[[time1,diam1],[time2,diam2]...]
+    time_axis = date2num(data_sorted[:,0]) #sorted times in days for timestamp lookups
     
     #init
-    unfinished_lines = []
+    unfinished_lines = init_tracker(lambda point: (date2num(point[0]),point[1])) #x=times,y=diams
     finalized_lines = []
     results_dict = {}
 
@@ -87,46 +76,46 @@ def find_growth(df_peaks,a,gret):
             base_low_diam_limit = diam0-10*ii #nm*timestep
             base_high_diam_limit = diam0+10*ii
             
-            ts_points = [point for point in data_sorted if point[0] == timestamp]  
+            ts_points = points_in_timestamp(data_sorted,time_axis,timestamp)
             closest_ts_points = [point for point in ts_points  \
                                  if point[1] >= base_low_diam_limit and point[1] <= base_high_diam_limit]
             if not closest_ts_points: #skip if no nearby datapoints in timestamp
                 continue
             
             #closest datapoint next in list
-            if points_in_existing_line(unfinished_lines,datapoint) == 0: #datapoint not in any line
+            num_of_lines = line_count(unfinished_lines,datapoint)
+            if num_of_lines == 0: #datapoint not in any line
                 nearby_datapoint = tuple(min(closest_ts_points, key=lambda point: abs(point[1] - diam0)))
                 time1, diam1 = nearby_datapoint
-            elif points_in_existing_line(unfinished_lines,datapoint) > 1: #datapoint in many lines (convergence)
-                converging_lines = [line for line in unfinished_lines if datapoint in line]
+            elif num_of_lines > 1: #datapoint in many lines (convergence)
+                converging_lines = lines_with_point(unfinished_lines,datapoint)
                 nearby_datapoint = tuple(min(closest_ts_points, key=lambda point: abs(point[1] - diam0)))
                 
                 #continue the line that best fits the next datapoint by minimizing MAPE
                 mapes = []
-                for line in converging_lines:
-                    line_with_new_point = line + [nearby_datapoint]
-                    x, y = extract_data(line_with_new_point) #x=times,y=diams
-                    popt, pcov = curve_fit(linear, x, y)
-                    mape = cal_mape(x,y,popt)
+                for line_id in converging_lines:
+                    x, y = extract_data(unfinished_lines['lines'][line_id]) #x=times,y=diams
+                    *_, y_all, residuals = fit_candidates(x,y,[date2num(nearby_datapoint[0])],[nearby_datapoint[1]],
+                                                          sums=unfinished_lines['sums'][line_id])
+                    mape = cal_mapes(y_all,residuals)[0]
                     mapes.append(mape)
 
                 min_mape_i = mapes.index(min(mapes))
-                line_before = converging_lines[min_mape_i]
-                iii = unfinished_lines.index(line_before)
+                iii = converging_lines[min_mape_i]
+                line_before = unfinished_lines['lines'][iii]
 
             else:
                 #minimize MAPE when choosing the new point
-                iii, line_before = [(i,line) for i,line in enumerate(unfinished_lines) if datapoint in line][0]
+                iii = lines_with_point(unfinished_lines,datapoint)[0]
+                line_before = unfinished_lines['lines'][iii]
 
-                mapes = []
-                for point in closest_ts_points:
-                    line_with_new_point = line_before + [point]
-                    x, y = extract_data(line_with_new_point) #x=times,y=diams
-                    popt, pcov = curve_fit(linear, x, y)
-                    mape = cal_mape(x,y,popt)
-                    mapes.append(mape)
+                #fit line with every candidate point at once
+                x, y = extract_data(line_before) #x=times,y=diams
+                x_new, y_new = extract_data(closest_ts_points)
+                *_, y_all, residuals = fit_candidates(x,y,x_new,y_new,sums=unfinished_lines['sums'][iii])
+                mapes = cal_mapes(y_all,residuals)
 
-                min_mape_i = mapes.index(min(mapes))
+                min_mape_i = int(np.argmin(mapes))
                 nearby_datapoint = tuple(closest_ts_points[min_mape_i])
 
                 time1, diam1 = nearby_datapoint
@@ -136,8 +125,7 @@ def find_growth(df_peaks,a,gret):
                 #more strict diameter range when finding the 3rd/4th point
                 if len(line_before) == 2 or len(line_before) == 3:
                     #calculate growth rate
-                    x, y = extract_data(line_before) #x=times,y=diams
-                    popt, pcov = curve_fit(linear, x, y)
+                    popt = fit_sums(unfinished_lines['sums'][iii])
                     GR = popt[0]/24 #nm/h
 
                     b = 2 if diam1 < 20 else 0.1 * diam1 #2nm if dp<20nm, else 10% of new peak 
@@ -150,25 +138,23 @@ def find_growth(df_peaks,a,gret):
                         
                     #if nearby datapoint is not in the diameter limit
                     if diam1 <= low_diam_limit or diam1 >= high_diam_limit:
-                        unfinished_lines[iii] = line_before[1:] + [nearby_datapoint]
+                        drop_first(unfinished_lines,iii)
+                        extend_line(unfinished_lines,iii,nearby_datapoint)
                         break
 
 
             ### add new point to a line ###
-            if points_in_existing_line(unfinished_lines,datapoint) == 0: #not in any line
-                unfinished_lines.append([datapoint,nearby_datapoint])
+            if num_of_lines == 0: #not in any line
+                new_line(unfinished_lines,[datapoint,nearby_datapoint])
                 break
 
-            elif points_in_existing_line(unfinished_lines,datapoint) > 0: #in line(s)
-                unfinished_lines[iii] = line_before + [nearby_datapoint]
-
-            #make sure datapoints in every line are sorted by time
-            unfinished_lines = [list(set(line)) for line in unfinished_lines]
-            unfinished_lines = [sorted(sublist, key=lambda x: x[0]) for sublist in unfinished_lines] 
+            elif num_of_lines > 0: #in line(s)
+                #datapoint is the last point of its lines, so the line stays sorted by time
+                extend_line(unfinished_lines,iii,nearby_datapoint)
             
             
             ### make a linear fit to check mape for line with new datapoint ###
-            iii, line_after = [(i,line) for i,line in enumerate(unfinished_lines) if datapoint in line and nearby_datapoint in line][0]
+            line_after = unfinished_lines['lines'][iii]
             
             #define variables for linear fit
             x, y = extract_data(line_after) #x=times,y=diams
@@ -182,23 +168,23 @@ def find_growth(df_peaks,a,gret):
         
 
             if len(line_after) <= min_line_length:
-                popt, pcov = curve_fit(linear, x, y)
+                popt = fit_sums(unfinished_lines['sums'][iii])
                 mape = cal_mape(x,y,popt)
 
                 if mape > mape_threshold:
-                    unfinished_lines[iii] = line_after[1:] #remove first point
+                    drop_first(unfinished_lines,iii) #remove first point
                     break
  
                 break
             else:
                 #calculate growth rates of first 4 and last 4 points
-                popt_first_4, pcov = curve_fit(linear, x_first_4, y_first_4)
+                popt_first_4 = fit_line(x_first_4, y_first_4)
                 GR_first_4 = popt_first_4[0] * 2
-                popt_last_4, pcov = curve_fit(linear, x_last_4, y_last_4)
+                popt_last_4 = fit_line(x_last_4, y_last_4)
                 GR_last_4 = popt_last_4[0] * 2
                 
                 #calculate mape of the whole line
-                popt, pcov = curve_fit(linear, x, y)
+                popt = fit_sums(unfinished_lines['sums'][iii])
                 mape = cal_mape(x,y,popt)
 
                 #if growth rate is under 1nm/h error is +-0.5nm/h, otherwise gret
@@ -211,9 +197,9 @@ def find_growth(df_peaks,a,gret):
 
 
                 if mape > mape_threshold:
-                    unfinished_lines = [line for line in unfinished_lines if line != line_after]
+                    remove_line(unfinished_lines,iii)
                     finalized_lines.append(line_after[:-1])
-                    unfinished_lines.append([datapoint,nearby_datapoint]) #new line starts with end of previous one
+                    new_line(unfinished_lines,[datapoint,nearby_datapoint]) #new line starts with end of previous one
                     # #calculate mae without the first and then last datapoint 
                     # popt, pcov = curve_fit(linear, x_first_excluded, y_first_excluded)
                     # mape_no_first = cal_mape(x_first_excluded,y_first_excluded,popt)
@@ -223,32 +209,33 @@ def find_growth(df_peaks,a,gret):
 
                     # #remove last or first point based on mae comparison
                     # if mape_no_last <= mape_no_first:
-                    #     unfinished_lines = [line for line in unfinished_lines if nearby_datapoint not in line]
+                    #     remove_line(unfinished_lines,iii)
                     #     finalized_lines.append(line_after[:-1])
-                    #     unfinished_lines.append([datapoint,nearby_datapoint]) #new line starts with end of previous one
+                    #     new_line(unfinished_lines,[datapoint,nearby_datapoint]) #new line starts with end of previous one
                     # else:
-                    #     unfinished_lines[iii] = line_after[1:]
+                    #     drop_first(unfinished_lines,iii)
                     break
                 
                 elif len(line_after) >= 4 and gr_error > gr_error_threshold:
                     #remove last point if threshold is exceeded
-                    unfinished_lines = [line for line in unfinished_lines if line != line_after]
+                    remove_line(unfinished_lines,iii)
                     finalized_lines.append(line_after[:-1])
-                    unfinished_lines.append([datapoint,nearby_datapoint])
+                    new_line(unfinished_lines,[datapoint,nearby_datapoint])
                     break
 
                 break
     
     #add rest of the lines to finalized lines and by timestamp
-    unfinished_lines = [line for line in unfinished_lines if len(line) >= min_line_length]
+    unfinished_lines = [line for line in unfinished_lines['lines'].values() if len(line) >= min_line_length]
     finalized_lines.extend(unfinished_lines)
     finalized_lines = [sorted(line, key=lambda x: x[0]) for line in finalized_lines] 
     
-    #robust fit, calculate mapes and growth rates
-    for i, finalized_line in enumerate(finalized_lines):
-        x = date2num([datapoint[0] for datapoint in finalized_line]) #time days
-        y = [datapoint[1] for datapoint in finalized_line] #diams nm
-        x_fit, y_fit, params = robust_fit(x,y)
+    #robust fit of all lines at once, calculate mapes and growth rates
+    xs = [date2num([datapoint[0] for datapoint in finalized_line]) for finalized_line in finalized_lines] #time days
+    ys = [[datapoint[1] for datapoint in finalized_line] for finalized_line in finalized_lines] #diams nm
+    robust_fits = robust_fit_lines(xs,ys)
+    
+    for i, (x, y, (x_fit, y_fit, params)) in enumerate(zip(xs,ys,robust_fits)):
         mape = cal_mape(x,y,[params[1],params[0]]) #%
         GR = params[1]/24 #nm/h
         
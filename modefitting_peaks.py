@@ -1,55 +1,285 @@
-import aerosol.fitting as af #janne's aerosol functions
-import json 
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
 import pandas as pd
+from hashlib import sha1
+from time import time_ns
+from concurrent.futures import ProcessPoolExecutor
+from data_cache import file_hash
+
+'''
+Mode fitting results are cached per timestamp in a folder of each dataset.
+The folder is named by a hash of the dataset file (data_cache.file_hash) and every fit is keyed by a
+hash of its timestamp and spectrum, so changed data is fitted again and an
+extended or shifted time period only fits the timestamps that are missing.
+Missing timestamps are fitted in blocks of at most one day in parallel, and the
+random state of each fit is seeded from its hash so results don't depend on
+how the timestamps are split.
+
+Fits are stored as columns in .npy files, sorted by time. Files are memory
+mapped so that only the timestamps of the requested time period are read.
+Every save writes a new snapshot folder and then switches the pointer file
+'current' to it, so processes that read the cache while another process
+saves it always see one complete snapshot.
+
+Format of cache folder:
+current = name of the snapshot folder in use
+snapshot_<time>_<pid>/keys, times, starts, counts = one value per timestamp (spectrum hash, time, index of first gaussian, number of gaussians)
+snapshot_<time>_<pid>/mean, sigma, amplitude, peak_diam = one value per gaussian
+'''
 
 #####################################################
-def find_peaks(df,file,start_date,fit_multimodes=False):
+def spectrum_keys(df):
+    '''Hashes of each timestamp and its spectrum (concentrations in all diameter channels).'''
+    times = df.index.strftime("%Y-%m-%d %H:%M:%S")
+    values = np.ascontiguousarray(df.to_numpy(dtype=float))
+    diams = np.asarray(df.columns,dtype=float).tobytes()
+    return [sha1(time.encode() + diams + row.tobytes()).hexdigest() for time, row in zip(times,values)]
+def empty_store():
+    '''Cache without any fits.'''
+    return {'keys': np.array([],dtype='S40'), 'times': np.array([],dtype='datetime64[s]'),
+            'starts': np.array([],dtype=np.int64), 'counts': np.array([],dtype=np.int64),
+            'mean': np.array([]), 'sigma': np.array([]), 'amplitude': np.array([]), 'peak_diam': np.array([])}
+def snapshot_dir(store_dir):
     '''
-    Finds mode fitting peaks using Janne Lampilahti's 
-    aerosol.fitting package, and saves them to a json file.
+    Folder of the current snapshot of the cache, None if nothing is cached yet.
+    Caches saved before snapshots have the columns in the cache folder itself.
     '''
+    try:
+        with open(os.path.join(store_dir,'current')) as pointer_file:
+            return os.path.join(store_dir,pointer_file.read().strip())
+    except FileNotFoundError:
+        return store_dir if os.path.isfile(os.path.join(store_dir,'times.npy')) else None
+def load_store(store_dir,start=None,end=None):
+    '''
+    Loads cached fits of timestamps between start and end (all if not given).
+    All columns of the current snapshot are opened first, so a save during loading
+    can't mix two snapshots. Returns empty cache if nothing is cached yet.
+    '''
+    while True:
+        snapshot = snapshot_dir(store_dir)
+        if snapshot is None:
+            return empty_store()
+        try:
+            files = {name: np.load(os.path.join(snapshot,f'{name}.npy'), mmap_mode='r') for name in empty_store()}
+            break
+        except FileNotFoundError:
+            if snapshot == snapshot_dir(store_dir):
+                raise
+            #snapshot was replaced while opening it, open the new one
     
-    file_name = file.split('.')[0]
-    
-    if fit_multimodes:
-        fit_results = af.fit_multimodes(df)
+    def columns(names,first,last):
+        #read only rows first...last-1 of memory mapped columns
+        return {name: np.array(files[name][first:last]) for name in names}
 
-        #write json data to a file
-        with open(f'{file_name[0:3]}{start_date[2:4]}{start_date[5:7]}{start_date[-2:]}_modefit.json', 'w') as output_file:
-            json.dump(fit_results, output_file, indent=2)
+    #timestamps and gaussians in the time period
+    times = files['times']
+    first = 0 if start is None else np.searchsorted(times, np.datetime64(start,'s'), side='left')
+    last = len(times) if end is None else np.searchsorted(times, np.datetime64(end,'s'), side='right')
+    store = columns(['keys','times','starts','counts'], first, last)
+    first_gaussian = store['starts'][0] if last > first else 0
+    last_gaussian = store['starts'][-1] + store['counts'][-1] if last > first else 0
+    store.update(columns(['mean','sigma','amplitude','peak_diam'], first_gaussian, last_gaussian))
+    store['starts'] -= first_gaussian
+    return store
+def save_store(store_dir,store):
+    '''
+    Saves cached fits to a new snapshot folder and switches the cache to it with one os.replace.
+    Older snapshots are removed, the previous one is kept for processes that are still opening it.
+    '''
+    os.makedirs(store_dir, exist_ok=True)
+    previous = snapshot_dir(store_dir)
+    new_name = f'snapshot_{time_ns()}_{os.getpid()}'
+    temporary_dir = os.path.join(store_dir, new_name + '.tmp')
+    os.makedirs(temporary_dir)
+    for name, column in store.items():
+        np.save(os.path.join(temporary_dir,f'{name}.npy'), column)
+    os.replace(temporary_dir, os.path.join(store_dir,new_name))
 
-    #load the results
-    try:
-        with open(f'{file_name[0:3]}{start_date[2:4]}{start_date[5:7]}{start_date[-2:]}_modefit.json') as file:
-            fits = json.load(file)
-    except FileNotFoundError:
-        print(f"ERROR: No such file or directory '{file_name[0:3]}{start_date[2:4]}{start_date[5:7]}{start_date[-2:]}_modefit.json'")
-        print("Please change: fit_multimodes = True")
-        raise SystemExit
+    pointer_file, pointer_path = tempfile.mkstemp(prefix='current.', suffix='.tmp', dir=store_dir)
+    with os.fdopen(pointer_file,'w') as output_file:
+        output_file.write(new_name)
+    os.replace(pointer_path, os.path.join(store_dir,'current'))
 
-    #making a dataframe from json file
-    rows_list = []
-    for timestamp in fits[0]:
-        ts = timestamp['time']
-        peak_diams = timestamp['peak_diams']
-        
-        for i, gaussians in enumerate(timestamp['gaussians']):
-            mean = gaussians['mean']
-            sigma = gaussians['sigma']
-            amplitude = gaussians['amplitude']
+    #remove snapshots (and unfinished ones) started before the previous one
+    def saved_at(name):
+        return int(name.split('_')[1].split('.')[0])
+    kept_since = saved_at(os.path.basename(previous)) if previous and previous != store_dir else saved_at(new_name)
+    for name in os.listdir(store_dir):
+        path = os.path.join(store_dir,name)
+        if name.startswith('snapshot_') and saved_at(name) < kept_since:
+            shutil.rmtree(path, ignore_errors=True)
+        elif previous == store_dir and name.endswith('.npy'): #columns of a cache saved before snapshots
+            os.remove(path)
+def fits_to_store(keys,fits):
+    '''Makes cache columns from fit results of timestamps with the given keys.'''
+    counts = np.array([len(fit['gaussians']) for fit in fits], dtype=np.int64)
+    gaussians = [gaussian for fit in fits for gaussian in fit['gaussians']]
+    return {'keys': np.array(keys, dtype='S40'),
+            'times': np.array([fit['time'] for fit in fits], dtype='datetime64[s]'),
+            'starts': np.cumsum(counts) - counts,
+            'counts': counts,
+            'mean': np.array([gaussian['mean'] for gaussian in gaussians], dtype=float),
+            'sigma': np.array([gaussian['sigma'] for gaussian in gaussians], dtype=float),
+            'amplitude': np.array([gaussian['amplitude'] for gaussian in gaussians], dtype=float),
+            'peak_diam': np.array([diam for fit, count in zip(fits,counts) for diam in fit['peak_diams'][:count]], dtype=float)}
+def merge_stores(store,new_store):
+    '''Adds new fits to cache, replacing fits with the same keys. Timestamps are kept sorted by time.'''
+    keep = ~np.isin(store['keys'], new_store['keys'])
+    counts = np.concatenate([store['counts'][keep], new_store['counts']])
+    starts = np.concatenate([store['starts'][keep], new_store['starts'] + len(store['mean'])]) #in both caches joined
+    times = np.concatenate([store['times'][keep], new_store['times']])
+    order = np.argsort(times, kind='stable')
+    rows = gaussian_rows(starts[order], counts[order])
 
-            dict_row = {'timestamp':ts,'amplitude':amplitude,'peak_diameter':peak_diams[i],'sigma':sigma} #diam unit m to nm
-            rows_list.append(dict_row)
+    merged = {'keys': np.concatenate([store['keys'][keep], new_store['keys']])[order],
+              'times': times[order],
+              'starts': np.cumsum(counts[order]) - counts[order],
+              'counts': counts[order]}
+    for name in ['mean','sigma','amplitude','peak_diam']:
+        merged[name] = np.concatenate([store[name], new_store[name]])[rows]
+    return merged
+def gaussian_rows(starts,counts):
+    '''Indices of gaussians of timestamps, in the order of timestamps.'''
+    offsets = starts - (np.cumsum(counts) - counts)
+    return np.arange(counts.sum()) + np.repeat(offsets, counts)
 
-    df_fits = pd.DataFrame(rows_list)  
+def timestamp_blocks(times,workers):
+    '''
+    Splits timestamps to blocks of at most one day. Days are split further
+    so that each worker gets a block. Returns list of index arrays.
+    '''
+    block_size = int(np.ceil(len(times)/workers))
+    days = times.normalize()
+    day_starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+    day_ends = np.r_[day_starts[1:], len(times)]
 
-    #timestamps to index, timestamp strings to datetime objects
+    blocks = []
+    for start, end in zip(day_starts,day_ends):
+        blocks.extend(np.arange(i,min(i+block_size,end)) for i in range(start,end,block_size))
+    return blocks
+def fit_block(df_block,seeds):
+    '''
+    Fits timestamps of a block one by one, random state is set from the seed of each timestamp.
+    The global random state is restored afterwards, so fitting doesn't change it for the rest of the run.
+    Returns list with the fit result of each timestamp (None if the timestamp was not fitted).
+    '''
+    import aerosol.fitting as af #janne's aerosol functions (only loaded when timestamps are fitted)
+    fits = []
+    random_state = np.random.get_state()
     try:
-        df_fits['timestamp']=pd.to_datetime(df_fits['timestamp'], format="%Y-%m-%d %H:%M:%S")
-    except KeyError:
+        for j, seed in enumerate(seeds):
+            np.random.seed(seed)
+            timestamp_fits = af.fit_multimodes(df_block.iloc[[j]])[0]
+            fits.append(timestamp_fits[0] if timestamp_fits else None)
+    finally:
+        np.random.set_state(random_state)
+    return fits
+def fit_timestamps(df,seeds,workers=None):
+    '''
+    Mode fitting of all timestamps in parallel (blocks of at most one day).
+    Returns fit result of each timestamp in timestamp order (None if not fitted).
+    
+    workers = number of worker processes (default: number of CPUs, 1 = no pool)
+    '''
+    workers = workers or os.cpu_count() or 1
+    blocks = timestamp_blocks(df.index,workers)
+    block_dfs = [df.iloc[block] for block in blocks]
+    block_seeds = [[seeds[i] for i in block] for block in blocks]
+
+    if workers == 1 or len(blocks) < 2:
+        results = list(map(fit_block, block_dfs, block_seeds))
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers,len(blocks))) as executor:
+            results = list(executor.map(fit_block, block_dfs, block_seeds))
+    return [fit for block_fits in results for fit in block_fits]
+
+def peak_table(store,keys):
+    '''
+    Makes a dataframe of mode fitting peaks (one row per gaussian)
+    from cached fits of timestamps with the given keys.
+    '''
+    positions = {key: i for i, key in enumerate(store['keys'])}
+    index = np.array([positions[key.encode()] for key in keys], dtype=np.int64)
+    counts = store['counts'][index]
+    rows = gaussian_rows(store['starts'][index], counts)
+
+    df_fits = pd.DataFrame({'amplitude': store['amplitude'][rows], 'peak_diameter': store['peak_diam'][rows], 'sigma': store['sigma'][rows]})
+    df_fits.index = pd.DatetimeIndex(np.repeat(store['times'][index], counts).astype('datetime64[ns]'), name='timestamp')
+    return df_fits
+def find_peaks(df,file,fit_multimodes=False,save_fits=True,cache_dir='modefit_cache',workers=None,new_fits=None):
+    '''
+    Finds mode fitting peaks using Janne Lampilahti's
+    aerosol.fitting package. Only timestamps that are not
+    in the cache of the dataset are fitted.
+
+    fit_multimodes = True to fit all timestamps again
+    save_fits = True to save new fits to the cache for later runs
+    cache_dir = folder of cache files
+    workers = number of processes for mode fitting (default: number of CPUs)
+    new_fits = list that new fits (cache columns) are added to instead of saving them,
+               for processes that share the cache (saved later with save_new_fits)
+    '''
+    df = df.dropna(how='all',axis=0) #timestamps without data are not fitted
+    if df.empty:
         print("ERROR: Chosen time period does not exist in this dataset!")
         raise SystemExit
-    df_fits.index=df_fits['timestamp']
-    df_modefits = df_fits.drop(['timestamp'], axis=1)
 
-    return df_modefits
\ No newline at end of file
+    store_dir = os.path.join(cache_dir, f'{file_hash(file)[:16]}_modefit')
+    store = load_store(store_dir,df.index[0],df.index[-1])
+    keys = spectrum_keys(df)
+
+    #fit timestamps that are missing from the cache
+    cached_keys = set(store['keys'])
+    missing = [i for i, key in enumerate(keys) if fit_multimodes or key.encode() not in cached_keys]
+    if missing:
+        print(f"Mode fitting {len(missing)}/{len(keys)} timestamps...")
+        fits = fit_timestamps(df.iloc[missing],[int(keys[i][:8],16) for i in missing],workers)
+        times = df.index[missing].strftime("%Y-%m-%d %H:%M:%S")
+        fits = [fit if fit is not None else {'time': time, 'gaussians': [], 'peak_diams': []} #cached without peaks
+                for fit, time in zip(fits,times)]
+        new_store = fits_to_store([keys[i] for i in missing],fits)
+
+        if new_fits is not None:
+            new_fits.append(new_store)
+        elif save_fits:
+            save_store(store_dir,merge_stores(load_store(store_dir),new_store))
+        store = merge_stores(store,new_store)
+
+    #making a dataframe from fit results
+    df_modefits = peak_table(store,keys)
+    if df_modefits.empty:
+        print("ERROR: No mode fitting peaks found in chosen time period!")
+        raise SystemExit
+
+    return df_modefits
+def save_new_fits(file,new_fits,cache_dir='modefit_cache'):
+    '''Saves fits collected by find_peaks (new_fits) to the cache of a dataset.'''
+    store_dir = os.path.join(cache_dir, f'{file_hash(file)[:16]}_modefit')
+    store = load_store(store_dir)
+    for new_store in new_fits:
+        store = merge_stores(store,new_store)
+    save_store(store_dir,store)
+def convert_json(json_file,df,file,cache_dir='modefit_cache'):
+    '''
+    One-time conversion of a json file of mode fits to the cache of a dataset.
+    Reads old XXXyymmdd_modefit.json files and json caches ({hash: fit}).
+    Fits are matched by time to the timestamps of df (data loaded from the dataset file),
+    fits of other timestamps are skipped. Returns number of converted timestamps.
+    '''
+    with open(json_file) as input_file:
+        fits = json.load(input_file)
+    fits = list(fits.values()) if isinstance(fits,dict) else fits[0]
+    fits_by_time = {fit['time']: fit for fit in fits}
+
+    df = df.dropna(how='all',axis=0)
+    times = df.index.strftime("%Y-%m-%d %H:%M:%S")
+    found = [i for i, time in enumerate(times) if time in fits_by_time]
+    keys = spectrum_keys(df.iloc[found])
+    
+    store_dir = os.path.join(cache_dir, f'{file_hash(file)[:16]}_modefit')
+    new_store = fits_to_store(keys,[fits_by_time[times[i]] for i in found])
+    save_store(store_dir,merge_stores(load_store(store_dir),new_store))
+    return len(found)
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+'''
+Append-only columnar buffer for collecting results one row at a time.
+Every column is a typed NumPy array that doubles its capacity when full,
+so adding n rows copies O(n) values in total. The buffer is turned into
+a DataFrame once at the end.
+
+Format of buffer:
+buffer = {'columns': {name: array}, 'length': number of rows}
+'''
+
+def init_buffer(dtypes,capacity=64):
+    '''
+    Creates an empty buffer.
+    dtypes = {column name: dtype}, columns are in this order in the DataFrame
+    '''
+    capacity = max(int(capacity),1)
+    return {'columns': {name: np.empty(capacity,dtype=dtype) for name, dtype in dtypes.items()}, 'length': 0}
+def append_row(buffer,**values):
+    '''Adds a row to the end of the buffer. Values are given as column=value.'''
+    length = buffer['length']
+    if length == buffer_capacity(buffer):
+        _grow(buffer)
+    for name, value in values.items():
+        buffer['columns'][name][length] = value
+    buffer['length'] = length + 1
+def buffer_capacity(buffer):
+    '''Number of rows that fit in the buffer before it grows.'''
+    return len(next(iter(buffer['columns'].values()), ()))
+def to_dataframe(buffer):
+    '''Creates a DataFrame of the rows in the buffer.'''
+    length = buffer['length']
+    return pd.DataFrame({name: column[:length] for name, column in buffer['columns'].items()})
+def _grow(buffer):
+    capacity = max(2*buffer_capacity(buffer),1)
+    for name, column in buffer['columns'].items():
+        grown = np.empty(capacity,dtype=column.dtype)
+        grown[:len(column)] = column
+        buffer['columns'][name] = grown